@@ -0,0 +1,413 @@
+"""Headless batch rendering for whole member lists.
+
+Usage:
+    python batch.py render mitglieder.csv -o ausgabe/ [--config config.json] [--jobs N]
+    python batch.py sheet mitglieder.csv -o boegen/ [--config config.json] [--jobs N]
+    python batch.py rerender ausgabe/ [bild.jpg ...] [-o neu/] [--jobs N]
+    python batch.py refresh ausgabe/ [--config config.json] [--jobs N] [--dry-run]
+
+The manifest is a CSV file (header row) or a JSON list of objects with the
+keys ``source``, ``text``, ``border_mm``, ``text_pos`` (``below``/``overlay``),
+``triangle``, ``pan_x``, ``pan_y`` and ``output``. Only ``source`` is required;
+relative paths are resolved against the manifest's directory. Without an
+``output`` extension the configured export format is used.
+
+``sheet`` imposes the entries in manifest order onto print sheets
+(``sheet_*`` config keys) instead of writing one file per portrait.
+
+Every rendered portrait gets a ``.render.json`` sidecar (see render_manifest).
+``rerender`` reproduces exports from those sidecars alone, with the config
+recorded in them; no config.json and no CSV list are needed. ``refresh``
+re-renders, in place and with the current config, only those exports whose
+inputs hash no longer matches (e.g. after a colour or font change).
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from config_handler import CONFIG_FILE, ConfigHandler
+from render_engine import RenderEngine, RenderParams, SheetLayout, SourceImage, TEXT_BELOW
+from render_manifest import (
+    ManifestError, background_sha256, config_sha256, engine_config, is_sidecar, manifest_output, read_manifest,
+    render_from_manifest, sidecar_path, stale_reason, write_manifest,
+)
+
+TRUE_VALUES = ("1", "true", "yes", "ja", "x", "y", "j")
+
+_engine = None
+_manifest_engines = {}
+
+
+def available_cpus():
+    """Cores this process may actually run on (respects CPU affinity)."""
+    try:
+        return len(os.sched_getaffinity(0)) or 1
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value or "").strip().lower() in TRUE_VALUES
+
+
+def _parse_float(value, default):
+    if value is None or str(value).strip() == "":
+        return default
+    return float(str(value).strip().replace(",", "."))
+
+
+def load_manifest(path):
+    """Read a CSV or JSON manifest into a list of plain dicts."""
+    if path.lower().endswith(".json"):
+        with open(path, "r", encoding="utf-8") as f:
+            entries = json.load(f)
+        if isinstance(entries, dict):
+            entries = entries.get("entries", [])
+    else:
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            entries = list(csv.DictReader(f))
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    for entry in entries:
+        source = (entry.get("source") or "").strip()
+        if source and not os.path.isabs(source):
+            entry["source"] = os.path.join(base_dir, source)
+    return entries
+
+
+def build_params(engine, entry):
+    """Translate one manifest entry into RenderParams (before fitting)."""
+    _, _, default_b = engine.border_range()
+    return RenderParams(
+        border_mm=_parse_float(entry.get("border_mm"), default_b),
+        pan_x=_parse_float(entry.get("pan_x"), 0.0),
+        pan_y=_parse_float(entry.get("pan_y"), 0.0),
+        text=(entry.get("text") or "").strip(),
+        text_pos=(entry.get("text_pos") or TEXT_BELOW).strip().lower(),
+        triangle=_parse_bool(entry.get("triangle")),
+    )
+
+
+def render_entry(engine, entry, output_path):
+    """Render one manifest entry to ``output_path`` exactly like the GUI export."""
+    source = SourceImage(entry["source"])
+    params = engine.fit(source.size, build_params(engine, entry))
+    img, img_params = source.load_for(engine, params)
+    engine.save(engine.render(img, img_params), output_path)
+    del img
+    write_manifest(engine, source, params, output_path)
+    return params
+
+
+def render_sheet(engine, layout, entries, output_path):
+    """Render up to ``layout.capacity`` entries into one sheet and encode it once.
+
+    A failing entry leaves its slot empty; returns ``[(source, error), ...]``.
+    """
+    sheet = layout.new_sheet()
+    used, errors = [], []
+    for entry, slot in zip(entries, layout.slots):
+        try:
+            source = SourceImage(entry["source"])
+            params = engine.fit(source.size, build_params(engine, entry))
+            img, img_params = source.load_for(engine, params)
+            engine.render_into(sheet, slot, img, img_params)
+            used.append(slot)
+        except Exception as ex:
+            errors.append((entry.get("source") or "?", f"{type(ex).__name__}: {ex}"))
+    layout.draw_cut_marks(sheet, used)
+    engine.save(sheet, output_path)
+    return errors
+
+
+def _init_worker(config):
+    global _engine
+    # Each result is saved before the next render starts, so output buffers can be reused.
+    _engine = RenderEngine(config, reuse_buffers=True)
+
+
+def _run_job(index, entry, output_path):
+    start = time.perf_counter()
+    try:
+        render_entry(_engine, entry, output_path)
+        return index, output_path, time.perf_counter() - start, None
+    except Exception as ex:
+        return index, output_path, time.perf_counter() - start, f"{type(ex).__name__}: {ex}"
+
+
+def _run_sheet(index, entries, output_path):
+    start = time.perf_counter()
+    try:
+        errors = render_sheet(_engine, SheetLayout(_engine), entries, output_path)
+        return index, output_path, time.perf_counter() - start, errors, None
+    except Exception as ex:
+        return index, output_path, time.perf_counter() - start, [], f"{type(ex).__name__}: {ex}"
+
+
+def _manifest_engine(manifest):
+    """One engine per recorded config and worker process."""
+    config = engine_config(manifest)
+    key = config_sha256(config)
+    engine = _manifest_engines.get(key)
+    if engine is None:
+        engine = _manifest_engines[key] = RenderEngine(config, reuse_buffers=True)
+    return engine
+
+
+def _run_rerender(index, manifest_path, out_dir):
+    start = time.perf_counter()
+    output_path = manifest_path
+    try:
+        manifest = read_manifest(manifest_path)
+        output_path = manifest_output(manifest, out_dir)
+        render_from_manifest(manifest, output_path, _manifest_engine(manifest))
+        return index, output_path, time.perf_counter() - start, None
+    except Exception as ex:
+        return index, output_path, time.perf_counter() - start, f"{type(ex).__name__}: {ex}"
+
+
+def _run_refresh(index, manifest_path):
+    start = time.perf_counter()
+    output_path = manifest_path
+    try:
+        manifest = read_manifest(manifest_path)
+        output_path = manifest_output(manifest)
+        render_from_manifest(manifest, output_path, _engine)
+        return index, output_path, time.perf_counter() - start, None
+    except Exception as ex:
+        return index, output_path, time.perf_counter() - start, f"{type(ex).__name__}: {ex}"
+
+
+def find_manifests(paths):
+    """Sidecars for the given sidecars, exported images and folders (not recursive)."""
+    found = []
+    for path in paths:
+        if os.path.isdir(path):
+            found.extend(sorted(os.path.join(path, name) for name in os.listdir(path) if is_sidecar(name)))
+        else:
+            found.append(path if is_sidecar(path) else sidecar_path(path))
+    return found
+
+
+def assign_outputs(engine, entries, out_dir):
+    """Pick an output path per entry; identical captions get a numeric suffix."""
+    used = set()
+    outputs = []
+    for entry in entries:
+        name = (entry.get("output") or "").strip()
+        if not name:
+            name = engine.suggest_filename(entry.get("text") or "") + engine.export_extension()
+        stem, ext = os.path.splitext(name)
+        ext = ext or engine.export_extension()
+        candidate = stem + ext
+        n = 2
+        while candidate.lower() in used:
+            candidate = f"{stem} ({n}){ext}"
+            n += 1
+        used.add(candidate.lower())
+        outputs.append(candidate if os.path.isabs(candidate) else os.path.join(out_dir, candidate))
+    return outputs
+
+
+def run_batch(config, entries, out_dir, jobs=None, log=print):
+    """Render all entries in a process pool. Returns the number of failures."""
+    engine = RenderEngine(config)
+    os.makedirs(out_dir, exist_ok=True)
+    outputs = assign_outputs(engine, entries, out_dir)
+    jobs = max(1, min(jobs or available_cpus(), len(entries) or 1))
+
+    failures = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(config,)) as pool:
+        futures = [pool.submit(_run_job, i, entry, outputs[i]) for i, entry in enumerate(entries)]
+        for future in as_completed(futures):
+            index, output_path, seconds, error = future.result()
+            source = entries[index].get("source") or "?"
+            if error:
+                failures += 1
+                log(f"FEHLER  {seconds * 1000:8.1f} ms  {source}: {error}")
+            else:
+                log(f"OK      {seconds * 1000:8.1f} ms  {source} -> {output_path}")
+    total = time.perf_counter() - start
+
+    done = len(entries) - failures
+    rate = done / total if total > 0 else 0.0
+    log(f"{done}/{len(entries)} Bilder in {total:.2f} s mit {jobs} Prozessen ({rate:.2f} Bilder/s), {failures} Fehler")
+    return failures
+
+
+def run_sheets(config, entries, out_dir, jobs=None, log=print):
+    """Impose all entries onto as many sheets as needed, one process per sheet.
+
+    Returns the number of failed portraits (a failed sheet counts all of its).
+    """
+    engine = RenderEngine(config)
+    layout = SheetLayout(engine)
+    os.makedirs(out_dir, exist_ok=True)
+    per_sheet = layout.capacity
+    chunks = [entries[i:i + per_sheet] for i in range(0, len(entries), per_sheet)]
+    ext = engine.export_extension()
+    outputs = [os.path.join(out_dir, f"bogen_{n:02d}{ext}") for n in range(1, len(chunks) + 1)]
+    jobs = max(1, min(jobs or available_cpus(), len(chunks) or 1))
+    log(f"{layout.cols} x {layout.rows} Porträts je Bogen, {len(chunks)} Bogen")
+
+    failures = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(config,)) as pool:
+        futures = [pool.submit(_run_sheet, i, chunk, outputs[i]) for i, chunk in enumerate(chunks)]
+        for future in as_completed(futures):
+            index, output_path, seconds, errors, error = future.result()
+            if error:
+                failures += len(chunks[index])
+                log(f"FEHLER  {seconds * 1000:8.1f} ms  {output_path}: {error}")
+                continue
+            failures += len(errors)
+            for source, message in errors:
+                log(f"FEHLER  {source}: {message}")
+            log(f"OK      {seconds * 1000:8.1f} ms  {len(chunks[index]) - len(errors)} Porträts -> {output_path}")
+    total = time.perf_counter() - start
+
+    log(f"{len(entries) - failures}/{len(entries)} Porträts auf {len(chunks)} Bogen in {total:.2f} s, {failures} Fehler")
+    return failures
+
+
+def run_rerender(manifest_paths, out_dir=None, jobs=None, log=print):
+    """Re-render exports from their sidecars. Returns the number of failures."""
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    jobs = max(1, min(jobs or available_cpus(), len(manifest_paths) or 1))
+
+    failures = 0
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = [pool.submit(_run_rerender, i, path, out_dir) for i, path in enumerate(manifest_paths)]
+        for future in as_completed(futures):
+            index, output_path, seconds, error = future.result()
+            if error:
+                failures += 1
+                log(f"FEHLER  {seconds * 1000:8.1f} ms  {manifest_paths[index]}: {error}")
+            else:
+                log(f"OK      {seconds * 1000:8.1f} ms  {manifest_paths[index]} -> {output_path}")
+    total = time.perf_counter() - start
+
+    log(f"{len(manifest_paths) - failures}/{len(manifest_paths)} Bilder in {total:.2f} s neu erzeugt, {failures} Fehler")
+    return failures
+
+
+def stale_manifests(config, manifest_paths, log=print):
+    """Split sidecars into stale ones ``[(path, reason)]`` and a count of current ones.
+
+    Only the manifests are read; sources are hashed later, by the workers.
+    """
+    config_sha = config_sha256(config)
+    background_sha = background_sha256(RenderEngine(config))
+    stale, current = [], 0
+    for path in manifest_paths:
+        try:
+            reason = stale_reason(read_manifest(path), config_sha, background_sha)
+        except ManifestError as ex:
+            log(f"FEHLER  {ex}")
+            continue
+        if reason:
+            stale.append((path, reason))
+        else:
+            current += 1
+    return stale, current
+
+
+def run_refresh(config, manifest_paths, jobs=None, dry_run=False, log=print):
+    """Re-render the stale exports in place with ``config``. Returns the number of failures."""
+    stale, current = stale_manifests(config, manifest_paths, log)
+    unreadable = len(manifest_paths) - len(stale) - current
+    log(f"{len(stale)} veraltet, {current} aktuell, {unreadable} unlesbar")
+    if dry_run or not stale:
+        for path, reason in stale:
+            log(f"VERALTET  {path}: {reason}")
+        return unreadable
+    jobs = max(1, min(jobs or available_cpus(), len(stale)))
+
+    failures = unreadable
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(config,)) as pool:
+        futures = [pool.submit(_run_refresh, i, path) for i, (path, _) in enumerate(stale)]
+        for future in as_completed(futures):
+            index, output_path, seconds, error = future.result()
+            path, reason = stale[index]
+            if error:
+                failures += 1
+                log(f"FEHLER  {seconds * 1000:8.1f} ms  {path}: {error}")
+            else:
+                log(f"OK      {seconds * 1000:8.1f} ms  {output_path} ({reason})")
+    total = time.perf_counter() - start
+
+    updated = len(stale) - (failures - unreadable)
+    log(f"{updated}/{len(stale)} Bilder in {total:.2f} s mit {jobs} Prozessen aktualisiert, {current} unverändert")
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ahnentafel Optimaldruck ohne GUI")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_render = sub.add_parser("render", help="Alle Einträge einer CSV/JSON-Liste rendern")
+    p_render.add_argument("manifest", help="CSV- oder JSON-Liste der Porträts")
+    p_render.add_argument("-o", "--output", default="ausgabe", help="Zielordner (Standard: ausgabe)")
+    p_render.add_argument("--config", default=CONFIG_FILE, help="Pfad zur config.json")
+    p_render.add_argument("-j", "--jobs", type=int, default=None, help="Anzahl Prozesse (Standard: alle Kerne)")
+
+    p_sheet = sub.add_parser("sheet", help="Mehrere Porträts je Druckbogen ausschießen")
+    p_sheet.add_argument("manifest", help="CSV- oder JSON-Liste der Porträts")
+    p_sheet.add_argument("-o", "--output", default="boegen", help="Zielordner (Standard: boegen)")
+    p_sheet.add_argument("--config", default=CONFIG_FILE, help="Pfad zur config.json")
+    p_sheet.add_argument("-j", "--jobs", type=int, default=None, help="Anzahl Prozesse (Standard: alle Kerne)")
+
+    p_rerender = sub.add_parser("rerender", help="Exporte aus ihren Render-Manifesten neu erzeugen")
+    p_rerender.add_argument("paths", nargs="+", help="Manifeste (.render.json), exportierte Bilder oder Ordner")
+    p_rerender.add_argument("-o", "--output", default=None, help="Zielordner (Standard: neben dem Manifest)")
+    p_rerender.add_argument("-j", "--jobs", type=int, default=None, help="Anzahl Prozesse (Standard: alle Kerne)")
+
+    p_refresh = sub.add_parser("refresh", help="Veraltete Exporte mit der aktuellen Konfiguration neu erzeugen")
+    p_refresh.add_argument("paths", nargs="+", help="Ordner mit Exporten, Manifeste oder Bilder")
+    p_refresh.add_argument("--config", default=CONFIG_FILE, help="Pfad zur config.json")
+    p_refresh.add_argument("-j", "--jobs", type=int, default=None, help="Anzahl Prozesse (Standard: alle Kerne)")
+    p_refresh.add_argument("-n", "--dry-run", action="store_true", help="Nur auflisten, nichts rendern")
+
+    args = parser.parse_args(argv)
+    if args.command == "rerender":
+        # The sidecars carry their own config; config.json is not consulted.
+        manifests = find_manifests(args.paths)
+        if not manifests:
+            print("Keine Render-Manifeste gefunden.", file=sys.stderr)
+            return 2
+        return 1 if run_rerender(manifests, args.output, jobs=args.jobs) else 0
+
+    config = ConfigHandler.load(args.config)
+    if not config:
+        print(f"Konfiguration {args.config} fehlt oder ist ungültig. Bitte zuerst main.py starten.", file=sys.stderr)
+        return 2
+
+    if args.command == "render":
+        entries = load_manifest(args.manifest)
+        failures = run_batch(config, entries, args.output, jobs=args.jobs)
+        return 1 if failures else 0
+    if args.command == "sheet":
+        try:
+            failures = run_sheets(config, load_manifest(args.manifest), args.output, jobs=args.jobs)
+        except ValueError as ex:
+            print(ex, file=sys.stderr)
+            return 2
+        return 1 if failures else 0
+    if args.command == "refresh":
+        failures = run_refresh(config, find_manifests(args.paths), jobs=args.jobs, dry_run=args.dry_run)
+        return 1 if failures else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,263 @@
+"""Benchmark suite for the render pipeline (no display needed).
+
+Usage:
+    python benchmark.py                      # full matrix, compare to benchmark_baseline.json
+    python benchmark.py --quick              # 2 and 12 MP sources only
+    python benchmark.py --save-baseline      # store this run as the new baseline
+    python benchmark.py --only caption,export --font C:/Windows/Fonts/calibri.ttf
+
+Each case is timed ``--repeat`` times; the median is compared against the
+stored baseline. A case slower than ``baseline * (1 + tolerance)`` (and by
+more than the noise floor) is reported and the exit code is 1.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import PIL
+from PIL import Image
+
+import render_engine
+from config_handler import COMPOSITORS, EXPORT_FORMATS, ConfigHandler, FRAME_PRESETS
+from render_engine import PreviewRenderer, RenderEngine, RenderParams, SourceImage
+
+SOURCE_SIZES_MP = (2, 12, 24, 50, 100)
+QUICK_SIZES_MP = (2, 12)
+BUND_MODES = (2, 3, 4, 5, 6)
+CAPTIONS = {
+    "kurz": "Muster, Max",
+    "normal": "Musterbruder, Max rec. 10.02.2026",
+    "lang": "von Musterhausen-Beispielstein, Maximilian Friedrich Wilhelm rec. 10.02.2026",
+}
+BENCHES = ("decode", "render", "layers", "caption", "preview", "background", "export", "startup")
+DEFAULT_BASELINE = "benchmark_baseline.json"
+NOISE_FLOOR_MS = 2.0
+PREVIEW_SCALE = 0.3
+
+
+def preset_config(preset, bund_mode=4, font=None, compositor="pillow"):
+    config = ConfigHandler.get_default()
+    config.update(FRAME_PRESETS[preset])
+    config["compositor"] = compositor
+    config["bund_mode"] = bund_mode
+    config["percentages"] = ConfigHandler.get_default_percentages(bund_mode) + [0.0] * (6 - bund_mode)
+    if font:
+        config["text_font"] = font
+    return config
+
+
+def make_source(workdir, megapixels):
+    """Create (once) a synthetic 3:2 camera-like JPEG of the given size."""
+    path = os.path.join(workdir, f"source_{megapixels}mp.jpg")
+    if os.path.exists(path):
+        return path
+    w = int((megapixels * 1e6 * 1.5) ** 0.5)
+    h = int(w / 1.5)
+    # Gradients plus noise: compresses and resamples like a real photo, unlike flat color.
+    r = Image.linear_gradient("L").resize((w, h))
+    g = Image.linear_gradient("L").rotate(90).resize((w, h))
+    b = Image.effect_noise((w, h), 40)
+    Image.merge("RGB", (r, g, b)).save(path, quality=90)
+    return path
+
+
+def make_background(workdir):
+    path = os.path.join(workdir, "background.jpg")
+    if not os.path.exists(path):
+        Image.effect_mandelbrot((2400, 3200), (-2.0, -1.5, 1.0, 1.5), 40).convert("RGB").save(path, quality=90)
+    return path
+
+
+def timed(fn, repeat, setup=None):
+    """Run ``fn`` ``repeat`` times; ``setup`` runs untimed before each call."""
+    runs = []
+    for _ in range(repeat):
+        state = setup() if setup else None
+        start = time.perf_counter()
+        fn(state) if setup else fn()
+        runs.append((time.perf_counter() - start) * 1000.0)
+    return {"median_ms": statistics.median(runs), "min_ms": min(runs), "runs": len(runs)}
+
+
+def startup_imports(repeat):
+    """Import cost per GUI module, each run in a fresh interpreter (cold start)."""
+    code = "import json, main; print(json.dumps(main.import_timed()))"
+    here = os.path.dirname(os.path.abspath(__file__))
+    runs = {}
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", code], cwd=here, capture_output=True, text=True, check=True).stdout
+        timings = json.loads(out)
+        for name, ms in timings + [("gesamt", sum(ms for _, ms in timings))]:
+            runs.setdefault(name, []).append(ms)
+    return {name: {"median_ms": statistics.median(v), "min_ms": min(v), "runs": len(v)} for name, v in runs.items()}
+
+
+def fitted_params(engine, size, text=CAPTIONS["normal"], **kw):
+    _, _, border = engine.border_range()
+    return engine.fit(size, RenderParams(border, text=text, triangle=True, **kw))
+
+
+def run_suite(args, log=print):
+    workdir = args.workdir
+    os.makedirs(workdir, exist_ok=True)
+    sizes = QUICK_SIZES_MP if args.quick else args.sizes
+    only = set(args.only) if args.only else set(BENCHES)
+    results = {}
+
+    def record(name, result):
+        results[name] = result
+        log(f"{name:<48} {result['median_ms']:10.2f} ms  (min {result['min_ms']:.2f})")
+
+    if "startup" in only:
+        for name, result in startup_imports(args.repeat).items():
+            record(f"startup/import/{name}", result)
+
+    for preset in FRAME_PRESETS:
+        tag = preset.replace(" ", "_")
+        config = preset_config(preset, font=args.font, compositor=args.compositor)
+
+        for mp in sizes:
+            if not only & {"decode", "render", "preview"}:
+                break
+            path = make_source(workdir, mp)
+            source = SourceImage(path)
+            engine = RenderEngine(config)
+            params = fitted_params(engine, source.size)
+            if "decode" in only:
+                record(f"decode/{tag}/{mp}MP", timed(lambda: source.load(params.scale), args.repeat))
+            img = source.load(params.scale)
+            img_params = source.params_for(img, params)
+            if "render" in only:
+                # Fresh engine per run: a first export, including all layer builds.
+                record(f"render/{tag}/{mp}MP", timed(lambda e: e.render(img, img_params), args.repeat, setup=lambda: RenderEngine(config)))
+            if "preview" in only:
+                preview_src = source.load(params.scale * PREVIEW_SCALE * PreviewRenderer.PROXY_HEADROOM)
+                preview_params = source.params_for(preview_src, params)
+                record(f"preview/{tag}/{mp}MP/cold", timed(
+                    lambda r: r.render(preview_src, preview_params), args.repeat,
+                    setup=lambda: PreviewRenderer(RenderEngine(config), PREVIEW_SCALE)))
+                renderer = PreviewRenderer(engine, PREVIEW_SCALE)
+                renderer.render(preview_src, preview_params)
+                pans = iter(range(10 ** 6))
+                record(f"preview/{tag}/{mp}MP/pan", timed(
+                    lambda: renderer.render(preview_src, preview_params.copy(pan_y=next(pans) % 7)), args.repeat))
+
+        if "layers" in only:
+            tiny = Image.new("RGB", (64, 64), "#808080")
+            for mode in BUND_MODES:
+                mode_config = preset_config(preset, bund_mode=mode, font=args.font, compositor=args.compositor)
+                probe = RenderEngine(mode_config)
+                params = fitted_params(probe, tiny.size, text="")
+                record(f"layers/{tag}/bund{mode}", timed(lambda e: e.render(tiny, params), args.repeat, setup=lambda: RenderEngine(mode_config)))
+
+        if "caption" in only:
+            for label, text in CAPTIONS.items():
+                def cold_engine():
+                    render_engine.clear_caches()
+                    return RenderEngine(config)
+                record(f"caption/{tag}/{label}", timed(lambda e: e.calc_text_block(text), args.repeat, setup=cold_engine))
+
+        if "background" in only:
+            bg_config = dict(config, background_source="file", background_image=make_background(workdir))
+            tiny = Image.new("RGB", (64, 64), "#808080")
+            params = fitted_params(RenderEngine(bg_config), tiny.size)
+
+            def cold_bg():
+                render_engine.clear_caches()
+                return RenderEngine(bg_config)
+            record(f"background/{tag}/cold", timed(lambda e: e.render(tiny, params), args.repeat, setup=cold_bg))
+            record(f"background/{tag}/warm", timed(lambda e: e.render(tiny, params), args.repeat, setup=lambda: RenderEngine(bg_config)))
+
+        if "export" in only:
+            engine = RenderEngine(config)
+            path = make_source(workdir, QUICK_SIZES_MP[-1])
+            source = SourceImage(path)
+            params = fitted_params(engine, source.size)
+            img = source.load(params.scale)
+            out = engine.render(img, source.params_for(img, params))
+            for fmt, ext in EXPORT_FORMATS.items():
+                target = os.path.join(workdir, f"export_{tag}{ext}")
+                record(f"export/{tag}/{fmt}", timed(lambda: engine.save(out, target), args.repeat))
+
+    return results
+
+
+def compare(results, baseline, tolerance, log=print):
+    """Return the list of regressed case names."""
+    regressions = []
+    for name, result in sorted(results.items()):
+        base = baseline.get(name)
+        if not base:
+            continue
+        now, then = result["median_ms"], base["median_ms"]
+        if now > then * (1.0 + tolerance) and now - then > NOISE_FLOOR_MS:
+            regressions.append(name)
+            log(f"LANGSAMER  {name}: {then:.2f} ms -> {now:.2f} ms (+{(now / then - 1) * 100:.0f}%)")
+    missing = sorted(set(baseline) - set(results))
+    if missing:
+        log(f"{len(missing)} Baseline-Fälle nicht gemessen (z.B. --quick/--only).")
+    return regressions
+
+
+def _csv(value, cast=str):
+    return [cast(v.strip()) for v in value.split(",") if v.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks der Render-Pipeline")
+    parser.add_argument("--quick", action="store_true", help="nur 2 und 12 MP Quellen")
+    parser.add_argument("--sizes", type=lambda v: _csv(v, int), default=list(SOURCE_SIZES_MP), help="Quellgrößen in MP, z.B. 2,24,100")
+    parser.add_argument("--only", type=_csv, default=None, help=f"Auswahl aus {','.join(BENCHES)}")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--font", default=None, help="Schriftdatei für die Beschriftung")
+    parser.add_argument("--compositor", choices=COMPOSITORS, default="pillow", help="Render-Backend (numpy optional)")
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "ahnentafel_bench"), help="Ordner für generierte Testbilder")
+    parser.add_argument("--output", default=None, help="Ergebnisse als JSON schreiben")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Ergebnisse als neue Baseline speichern")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="erlaubte Verlangsamung (0.25 = 25%%)")
+    args = parser.parse_args(argv)
+
+    results = run_suite(args)
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "pillow": PIL.__version__,
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "compositor": args.compositor,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=4)
+        print(f"Baseline gespeichert: {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"Keine Baseline ({args.baseline}) vorhanden; mit --save-baseline anlegen.")
+        return 0
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = json.load(f).get("results", {})
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print(f"{len(regressions)} Regression(en) gegenüber {args.baseline}.")
+        return 1
+    print(f"Keine Regression gegenüber {args.baseline}.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
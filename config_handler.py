@@ -1,9 +1,75 @@
+import copy
 import json
 import os
+import tempfile
 
 CONFIG_FILE = "config.json"
 MAX_MM_LIMIT = 7.0
 
+FRAME_PRESETS = {
+	"Neuer Holzrahmen": {
+		"photo_h_mm": 100.0,
+		"photo_w_mm": 69.5,
+		"canvas_h_mm": 130.0,
+		"canvas_w_mm": 90.0,
+		"border_default_mm": 3.0,
+		"fixed_bottom_mm": 7.0,
+		"fixed_distance_mm": 5.0,
+	},
+	"Alter Holzrahmen": {
+		"photo_h_mm": 100.0,
+		"photo_w_mm": 71.0,
+		"canvas_h_mm": 130.0,
+		"canvas_w_mm": 90.0,
+		"border_default_mm": 1.7,
+		"fixed_bottom_mm": 5.0,
+		"fixed_distance_mm": 4.0,
+	},
+}
+
+# Export formats (config "export_format") and their file extension.
+EXPORT_FORMATS = {
+	"jpeg": ".jpg",
+	"png": ".png",
+	"tiff16": ".tif",
+}
+JPEG_SUBSAMPLING = ("auto", "4:4:4", "4:2:2", "4:2:0")
+# Render backends (config "compositor"); numpy is optional.
+COMPOSITORS = ("pillow", "numpy")
+
+# Config keys by what they affect.
+GEOMETRY_KEYS = frozenset({"photo_w_mm", "photo_h_mm", "canvas_w_mm", "canvas_h_mm"})
+BORDER_KEYS = frozenset({"border_min_mm", "border_max_mm", "border_default_mm"})
+# Everything that changes the rendered pixels (the compositor does not: both are pixel-identical).
+# memory_limit_mb decides whether huge scans are decoded in bands, which can round differently.
+RENDER_KEYS = GEOMETRY_KEYS | BORDER_KEYS | frozenset({
+	"bund_mode", "colors", "percentages", "background_source", "use_background_image", "background_image",
+	"fixed_distance_mm", "fixed_bottom_mm", "fixed_top_p_mm", "text_bg_color", "text_color", "text_font",
+	"triangle_percent", "memory_limit_mb",
+})
+EXPORT_KEYS = frozenset({
+	"export_format", "jpeg_quality", "jpeg_optimize", "jpeg_progressive", "jpeg_subsampling", "png_compress_level",
+})
+
+
+def write_json_atomic(path, data):
+	"""Write to a temp file next to ``path`` and rename it into place, so an
+	interrupted write never leaves a truncated file behind."""
+	folder = os.path.dirname(os.path.abspath(path))
+	fd, tmp = tempfile.mkstemp(prefix=".tmp-", suffix=".json", dir=folder)
+	try:
+		with os.fdopen(fd, "w", encoding="utf-8") as f:
+			json.dump(data, f, indent=4)
+			f.flush()
+			os.fsync(f.fileno())
+		os.replace(tmp, path)
+	except BaseException:
+		try:
+			os.remove(tmp)
+		except OSError:
+			pass
+		raise
+
 
 class ConfigHandler:
 	@staticmethod
@@ -45,14 +111,30 @@ class ConfigHandler:
 			"triangle_percent": 50.0,
 			"use_background_image": False,
 			"background_image": "",
+			"preview_fps": 60.0,
+			"perf_stats": False,
+			"perf_log_file": "",
+			"export_format": "jpeg",
+			"jpeg_quality": 98,
+			"jpeg_optimize": False,
+			"jpeg_progressive": False,
+			"jpeg_subsampling": "auto",
+			"png_compress_level": 6,
+			"sheet_w_mm": 210.0,
+			"sheet_h_mm": 297.0,
+			"sheet_margin_mm": 8.0,
+			"sheet_gutter_mm": 4.0,
+			"sheet_cut_marks": True,
+			"compositor": "pillow",
+			"memory_limit_mb": 512,
 		}
 
 	@staticmethod
-	def load():
-		if not os.path.exists(CONFIG_FILE):
+	def load(path=CONFIG_FILE):
+		if not os.path.exists(path):
 			return None
 		try:
-			with open(CONFIG_FILE, "r", encoding="utf-8") as f:
+			with open(path, "r", encoding="utf-8") as f:
 				loaded = json.load(f)
 
 			base = ConfigHandler.get_default()
@@ -68,8 +150,81 @@ class ConfigHandler:
 			return None
 
 	@staticmethod
-	def save(config):
-		with open(CONFIG_FILE, "w", encoding="utf-8") as f:
-			json.dump(config, f, indent=4)
+	def save(config, path=CONFIG_FILE):
+		write_json_atomic(path, config)
+
+
+class ConfigStore:
+	"""The one in-memory copy of the configuration.
+
+	Readers use ``config`` or the typed getters; writers go through ``update`` /
+	``replace``, which save atomically and then tell every subscriber which keys
+	changed. Each write installs a new dict, so a snapshot handed to an engine
+	or worker thread never changes underneath it.
+	"""
+
+	def __init__(self, path=CONFIG_FILE):
+		self.path = path
+		self._config = None
+		self._listeners = []
+
+	def load(self):
+		"""Read the file once; returns False if there is no usable config yet."""
+		self._config = ConfigHandler.load(self.path)
+		return self._config is not None
+
+	@property
+	def config(self):
+		"""Current snapshot; treat it as read-only."""
+		return self._config if self._config is not None else ConfigHandler.get_default()
+
+	def get(self, key, default=None):
+		return self.config.get(key, default)
+
+	def _typed(self, key, convert, default):
+		value = self.config.get(key)
+		if value is not None:
+			try:
+				return convert(value)
+			except (TypeError, ValueError):
+				pass
+		if default is None:
+			default = ConfigHandler.get_default().get(key)
+		return convert(default) if default is not None else None
+
+	def get_float(self, key, default=None):
+		return self._typed(key, float, default)
+
+	def get_int(self, key, default=None):
+		return self._typed(key, lambda v: int(float(v)), default)
+
+	def get_bool(self, key, default=None):
+		return self._typed(key, bool, default)
+
+	def get_str(self, key, default=None):
+		return self._typed(key, str, default)
+
+	def subscribe(self, listener):
+		"""``listener(changed_keys)`` is called after every write that changed something."""
+		self._listeners.append(listener)
+
+	def update(self, changes):
+		"""Set the given keys; returns the set of keys whose value actually changed."""
+		config = copy.deepcopy(self.config)
+		config.update(changes)
+		return self.replace(config)
+
+	def replace(self, config):
+		"""Install ``config`` as a whole (the settings dialog saves this way)."""
+		old = self._config or {}
+		config = copy.deepcopy(config)
+		changed = {k for k in set(old) | set(config) if old.get(k) != config.get(k)}
+		if self._config is not None and not changed:
+			return changed
+		ConfigHandler.save(config, self.path)
+		self._config = config
+		for listener in list(self._listeners):
+			listener(changed)
+		return changed
 
 
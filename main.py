@@ -1,18 +1,62 @@
-import tkinter as tk
+"""Start the GUI.
 
-from portrait_app import PortraitProApp
+``python main.py --startup-report`` prints how long each module took to import
+and the time until the first window was painted; the latter is also recorded
+as the ``startup`` stage when ``perf_stats``/``perf_log_file`` are enabled.
+"""
+import importlib
+import sys
+import time
 
-try:
-    from tkinterdnd2 import TkinterDnD
-    DND_AVAILABLE = True
-except Exception:
-    TkinterDnD = None
-    DND_AVAILABLE = False
+STARTED = time.perf_counter()
 
+# Imported one by one, dependencies first, so each entry is that module's own cost.
+STARTUP_IMPORTS = ("tkinter", "PIL.Image", "stage_timer", "config_handler", "render_engine", "render_scheduler", "portrait_app")
 
-def main():
-    root = TkinterDnD.Tk() if DND_AVAILABLE else tk.Tk()
+
+def import_timed(names=STARTUP_IMPORTS):
+    """Import ``names`` in order; returns ``[(name, ms), ...]``."""
+    timings = []
+    for name in names:
+        start = time.perf_counter()
+        importlib.import_module(name)
+        timings.append((name, (time.perf_counter() - start) * 1000.0))
+    return timings
+
+
+def format_startup_report(imports, first_paint_ms):
+    lines = [f"import {name:<20} {ms:8.1f} ms" for name, ms in imports]
+    lines.append(f"imports gesamt{'':<13} {sum(ms for _, ms in imports):8.1f} ms")
+    lines.append(f"erstes Bild{'':<16} {first_paint_ms:8.1f} ms")
+    return "\n".join(lines)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    imports = import_timed()
+
+    import tkinter as tk
+    from portrait_app import PortraitProApp
+    from stage_timer import TIMER
+
+    root = tk.Tk()
     PortraitProApp(root)
+
+    def after_first_paint():
+        first_paint_ms = (time.perf_counter() - STARTED) * 1000.0
+        if TIMER.enabled:
+            TIMER.record("startup", first_paint_ms)
+        if "--startup-report" in argv:
+            print(format_startup_report(imports, first_paint_ms), flush=True)
+        # Drag & drop is only used by the settings dialog; load it now that the window is up.
+        root.after(1, load_dnd)
+
+    def load_dnd():
+        from settings_window import enable_dnd
+        enable_dnd(root)
+
+    # Idle callbacks run in order, so this one runs after the initial redraws.
+    root.after_idle(after_first_paint)
     root.mainloop()
 
 
@@ -1,141 +1,163 @@
-import re
-import math
-import webbrowser
+import os
 import tkinter as tk
-from tkinter import filedialog, messagebox
+from tkinter import filedialog, messagebox, ttk
 
-from PIL import Image, ImageDraw, ImageFont, ImageTk
+from PIL import Image
 
-from config_handler import ConfigHandler, MAX_MM_LIMIT
-from settings_window import SettingsWindow
+from config_handler import BORDER_KEYS, EXPORT_FORMATS, GEOMETRY_KEYS, RENDER_KEYS, ConfigStore
+from render_engine import PreviewRenderer, RenderEngine, RenderParams, SourceImage
+from render_scheduler import ExportQueue, PreviewWorker, RenderScheduler
+from stage_timer import TIMER
+
+# ImageTk, webbrowser, settings_window and render_manifest (hashlib) are
+# imported where they are first needed: none is required to show the window.
+
+EXPORT_FILETYPES = {
+    "jpeg": ("JPEG", "*.jpg *.jpeg"),
+    "png": ("PNG", "*.png"),
+    "tiff16": ("TIFF 16 Bit", "*.tif *.tiff"),
+}
+
+# What a settings change invalidates. Geometry rebuilds the engines, other engine
+# keys drop only the caches built from them (RenderEngine.reconfigure). Keys not
+# listed (export, sheet, dialog state) are read when they are used.
+ENGINE_KEYS = RENDER_KEYS | {"compositor"}
+PERF_KEYS = frozenset({"perf_stats", "perf_log_file"})
 
 class PortraitProApp:
     PREVIEW_SCALE = 0.35
     def __init__(self, root):
         self.root = root
-        self.config = ConfigHandler.load()
-        if not self.config:
+        # Exports belong to the app, not to the main UI widgets.
+        self.export_queue = ExportQueue(self.root, self._on_export_update)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
+        # config.json is read once; settings changes arrive as change events.
+        self.store = ConfigStore()
+        self.store.subscribe(self._on_config_changed)
+        if not self.store.load():
             self.root.withdraw()
-            SettingsWindow(self.root, self.on_initial_config_done, is_initial=True)
+            from settings_window import SettingsWindow
+            SettingsWindow(self.root, self.on_initial_config_done, is_initial=True, store=self.store)
         else:
+            self.config = self.store.config
             self.init_main_ui()
 
     def on_initial_config_done(self):
         self.root.deiconify()
-        self.config = ConfigHandler.load()
+        self.config = self.store.config
         self.init_main_ui()
 
-    def show_settings_menu(self):
-        SettingsWindow(self.root, self.refresh_config)
+    def on_close(self):
+        if self.export_queue.pending and not messagebox.askyesno(
+                "Export läuft", "Es laufen noch Exporte. Trotzdem beenden?"):
+            return
+        # Queued exports are dropped, the running one is finished (window already gone).
+        self.root.withdraw()
+        if hasattr(self, "preview_worker"):
+            self.scheduler.cancel()
+            self.preview_worker.close()
+        self.export_queue.close(wait=True)
+        self.root.destroy()
 
-    def refresh_config(self):
-        self.config = ConfigHandler.load()
-        if hasattr(self, 'main_frame'): self.main_frame.destroy()
-        if hasattr(self, 'toolbar'): self.toolbar.destroy()
-        self.init_main_ui()
+    def show_settings_menu(self):
+        from settings_window import SettingsWindow
+        SettingsWindow(self.root, store=self.store)
+
+    def _on_config_changed(self, changed):
+        self.config = self.store.config
+        if not hasattr(self, "main_frame"):
+            return  # first run: the main UI is built from the new config afterwards
+        if changed & ENGINE_KEYS:
+            self.scheduler.cancel()
+            # A render still running with the old settings must not be shown.
+            self.preview_worker.cancel()
+            if changed & GEOMETRY_KEYS:
+                self._build_engines()
+                self.canvas.config(width=self.preview_renderer.size[0], height=self.preview_renderer.size[1])
+            else:
+                # Keep the engines; only the caches built from the changed keys are dropped.
+                self.engine.reconfigure(self.config, changed)
+                self.preview_renderer.reconfigure(self.config, changed)
+            if changed & BORDER_KEYS:
+                self._apply_border_range(reset="border_default_mm" in changed)
+            self._dim_last_inputs = None
+            if self.source:
+                self.recalc_image_fit()
+                if changed & GEOMETRY_KEYS:
+                    self._load_preview_src()
+            self.request_preview(fit=True)
+        if "preview_fps" in changed:
+            self.scheduler.set_fps(self.store.get_float("preview_fps", RenderScheduler.DEFAULT_FPS))
+        if changed & PERF_KEYS:
+            self._apply_perf_settings()
 
-    def _get_text_font(self, size):
-        font_name = self.config.get("text_font", "arial.ttf")
-        if not font_name:
-            font_name = "arial.ttf"
-        try:
-            return ImageFont.truetype(font_name, size)
-        except Exception:
-            try:
-                return ImageFont.truetype("arial.ttf", size)
-            except Exception:
-                return ImageFont.load_default()
+    @staticmethod
+    def _open_url(url):
+        import webbrowser
+        webbrowser.open(url)
+
+    def _render_params(self):
+        """Snapshot the Tk state into explicit engine parameters."""
+        return RenderParams(
+            border_mm=self.border_val.get(),
+            pan_x=self.pan_x,
+            pan_y=self.pan_y,
+            scale=self.current_scale,
+            text=self._get_effective_text(),
+            text_pos=self.text_pos_var.get(),
+            triangle=self.use_triangle_var.get(),
+        )
 
-    def _mm_to_px(self, mm_value, ceil_value=False):
-        px = float(mm_value) * self.MM_TO_PX
-        if ceil_value:
-            return max(1, int(math.ceil(px - 1e-9)))
-        return max(1, int(round(px)))
+    def _dim_inputs(self):
+        """Everything the dimension sketch depends on (pan is deliberately absent)."""
+        cfg = self.config
+        border_mm_req = float(self.border_val.get()) if hasattr(self, "border_val") else float(cfg.get("border_default_mm", 2.3))
+        text = self._get_effective_text() if hasattr(self, "entry_text") else ""
+        return (
+            border_mm_req, text,
+            cfg.get("photo_w_mm"), cfg.get("photo_h_mm"),
+            cfg.get("fixed_distance_mm"), cfg.get("fixed_bottom_mm"), cfg.get("fixed_top_p_mm"),
+            cfg.get("bund_mode"), tuple(cfg.get("colors", ())), tuple(cfg.get("percentages", ())),
+        )
 
-    @staticmethod
-    def _is_near_int(value, tol=1e-7):
-        return abs(value - round(value)) <= tol
-
-    def _find_effective_dpi(self, width_mm, height_mm, min_dpi=300, max_dpi=1200):
-        """Pick the smallest DPI >= min_dpi that maps both mm sides to integer pixels."""
-        start = max(1, int(math.ceil(float(min_dpi))))
-        w_mm = float(width_mm)
-        h_mm = float(height_mm)
-        if w_mm <= 0 or h_mm <= 0:
-            return float(start)
-
-        for dpi in range(start, max_dpi + 1):
-            w_px = (w_mm / 25.4) * dpi
-            h_px = (h_mm / 25.4) * dpi
-            if self._is_near_int(w_px) and self._is_near_int(h_px):
-                return float(dpi)
-        return float(start)
-
-    def _calc_text_font(self, text):
-        if not text:
-            return self._get_text_font(12)
-        fs = 1
-        font = self._get_text_font(fs)
-        side_mm = max(0.0, min(MAX_MM_LIMIT, float(self.config.get("fixed_distance_mm", 6.0))))
-        max_w = max(1, self.PHOTO_W - 2 * self._mm_to_px(side_mm) - 2)
-        while font.getbbox(text)[2] - font.getbbox(text)[0] < max_w and fs < 400:
-            fs += 1
-            font = self._get_text_font(fs)
-        return font
-
-    def _calc_text_block(self, text):
-        if not text:
-            return None, 0, 0, 0, 0, 0, 0, 0, 0
-        font = self._calc_text_font(text)
-        bbox = font.getbbox(text)
-        font_h = bbox[3] - bbox[1]
-        text_w = bbox[2] - bbox[0]
-        text_top = bbox[1]
-        text_bottom = bbox[3]
-        side_mm = max(0.0, min(MAX_MM_LIMIT, float(self.config.get("fixed_distance_mm", 6.0))))
-        bottom_mm = max(0.0, min(MAX_MM_LIMIT, float(self.config.get("fixed_bottom_mm", 6.0))))
-        top_mm = max(0.0, min(MAX_MM_LIMIT, float(self.config.get("fixed_top_p_mm", 1.0))))
-        side_px = self._mm_to_px(side_mm)
-        bottom_px = self._mm_to_px(bottom_mm)
-        top_px = self._mm_to_px(top_mm)
-        # Small safety padding prevents anti-aliased glyph pixels from being clipped.
-        rect_h = font_h + bottom_px + top_px + 2
-        return font, rect_h, font_h, side_px, bottom_px, top_px, text_w, text_top, text_bottom
-
-    def _get_effective_border_px(self):
-        req = int(float(self.border_val.get()) * self.MM_TO_PX)
-        max_allowed = max(0, (min(self.PHOTO_W, self.PHOTO_H) - 2) // 2)
-        return max(0, min(req, max_allowed))
-
-    def _px_to_mm(self, px):
-        return px / self.MM_TO_PX
+    def _dim_item(self, key, kind, *coords, **opts):
+        """Create a sketch item once, afterwards only move/relabel it."""
+        c = self.dim_canvas
+        self._dim_used.append(key)
+        item = self._dim_items.get(key)
+        if item is None:
+            self._dim_items[key] = getattr(c, f"create_{kind}")(*coords, **opts)
+            self._dim_restack = True
+        else:
+            c.coords(item, *coords)
+            c.itemconfigure(item, state="normal", **opts)
 
     def _draw_dimension_info(self):
         if not hasattr(self, "dim_canvas"):
             return
 
         c = self.dim_canvas
-        c.delete("all")
-
-        # Motif/frame size (exact cut size)
-        motif_w_mm = float(self.config.get("photo_w_mm", 70.0))
-        motif_h_mm = float(self.config.get("photo_h_mm", 90.0))
-
-        border_mm_req = float(self.border_val.get()) if hasattr(self, "border_val") else float(self.config.get("border_default_mm", 2.3))
-        border_mm_max = max(0.0, (min(motif_w_mm, motif_h_mm) - 0.2) / 2.0)
-        border_mm = min(border_mm_req, border_mm_max)
-        inner_w_mm = max(0.0, motif_w_mm - 2 * border_mm)
-        inner_h_mm = max(0.0, motif_h_mm - 2 * border_mm)
-
-        side_mm = max(0.0, min(MAX_MM_LIMIT, float(self.config.get("fixed_distance_mm", 6.0))))
-        bottom_mm = max(0.0, min(MAX_MM_LIMIT, float(self.config.get("fixed_bottom_mm", 6.0))))
-        top_mm = max(0.0, min(MAX_MM_LIMIT, float(self.config.get("fixed_top_p_mm", 1.0))))
-
-        text = self._get_effective_text() if hasattr(self, "entry_text") else ""
-        _, text_h_px, font_h_px, _, _, _, _, _, _ = self._calc_text_block(text)
-        has_text = bool(text) and text_h_px > 0
-        text_h_mm = self._px_to_mm(text_h_px) if has_text else 0.0
-        font_h_mm = self._px_to_mm(font_h_px) if has_text else 0.0
+        if getattr(self, "_dim_canvas_ref", None) is not c:
+            # New canvas (UI rebuilt): start a fresh item registry.
+            self._dim_canvas_ref = c
+            self._dim_items = {}
+            self._dim_last_inputs = None
+        inputs = self._dim_inputs()
+        if inputs == self._dim_last_inputs:
+            return
+        self._dim_last_inputs = inputs
+        self._dim_used = []
+        self._dim_restack = False
+        first_draw = not self._dim_items
+        border_mm_req, text = inputs[0], inputs[1]
+
+        # Motif/frame size (exact cut size), insets and caption height come from the layout plan.
+        plan = self.engine.layout(border_mm_req, text)
+        motif_w_mm, motif_h_mm = plan.photo_w_mm, plan.photo_h_mm
+        border_mm, inner_w_mm, inner_h_mm = plan.border_mm, plan.inner_w_mm, plan.inner_h_mm
+        side_mm, bottom_mm, top_mm = plan.side_mm, plan.bottom_mm, plan.top_mm
+        text_h_mm, font_h_mm = plan.text_h_mm, plan.font_h_mm
+        has_text = plan.has_text and plan.rect_h > 0
         image_h_mm = max(0.0, inner_h_mm - text_h_mm) if has_text else inner_h_mm
 
         text_block_top_mm_inner = max(0.0, inner_h_mm - text_h_mm) if has_text else 0.0
@@ -161,10 +183,12 @@ class PortraitProApp:
         ix0, iy0 = x0 + bi, y0 + bi
         ix1, iy1 = x1 - bi, y1 - bi
 
+        item = self._dim_item
+
         # Flag border zones (left/right): visualize where the colored border sits.
-        mode = int(self.config.get("bund_mode", 4))
-        cols = self.config.get("colors", ["#FFFFFF", "#008000", "#eb0000", "#FFFFFF"])
-        pcts = self.config.get("percentages", [25.0, 25.0, 25.0, 25.0])
+        mode = self.store.get_int("bund_mode")
+        cols = self.store.get("colors", ["#FFFFFF", "#008000", "#eb0000", "#FFFFFF"])
+        pcts = self.store.get("percentages", [25.0, 25.0, 25.0, 25.0])
         if border_mm > 0:
             curr_y = y0
             for i in range(mode):
@@ -172,69 +196,79 @@ class PortraitProApp:
                 seg_h = (pct / 100.0) * (y1 - y0)
                 y_end = curr_y + seg_h if i < mode - 1 else y1
                 col = cols[i] if i < len(cols) else "#CCCCCC"
-                c.create_rectangle(x0, curr_y, ix0, y_end, outline="", fill=col)
-                c.create_rectangle(ix1, curr_y, x1, y_end, outline="", fill=col)
+                item(("stripe_l", i), "rectangle", x0, curr_y, ix0, y_end, outline="", fill=col)
+                item(("stripe_r", i), "rectangle", ix1, curr_y, x1, y_end, outline="", fill=col)
                 curr_y = y_end
 
         # Motif and inner image bounds
-        c.create_rectangle(x0, y0, x1, y1, outline="#111", width=2)
+        item("motif", "rectangle", x0, y0, x1, y1, outline="#111", width=2)
 
         # Inner image area inside frame border
-        c.create_rectangle(ix0, iy0, ix1, iy1, outline="#1f77b4", width=1, dash=(4, 3))
+        item("inner", "rectangle", ix0, iy0, ix1, iy1, outline="#1f77b4", width=1, dash=(4, 3))
 
         text_area_top = iy1 - (text_h_mm * scale)
         if has_text:
-            c.create_rectangle(ix0, text_area_top, ix1, iy1, outline="#8c6d1f", fill="#fff3cd", width=1)
+            item("text_area", "rectangle", ix0, text_area_top, ix1, iy1, outline="#8c6d1f", fill="#fff3cd", width=1)
             text_start_y = text_area_top + top_mm * scale
             text_x_left = ix0 + side_mm * scale
             text_x_right = ix1 - side_mm * scale
-            c.create_line(ix0, text_start_y, ix1, text_start_y, fill="#b35300", dash=(3, 2))
-            c.create_line(text_x_left, text_area_top, text_x_left, iy1, fill="#b35300", dash=(3, 2))
-            c.create_line(text_x_right, text_area_top, text_x_right, iy1, fill="#b35300", dash=(3, 2))
-            c.create_text((text_x_left + text_x_right) / 2, text_start_y - 8, text="Schrift beginnt hier", fill="#b35300", font=("Arial", 8, "bold"))
+            item("text_start", "line", ix0, text_start_y, ix1, text_start_y, fill="#b35300", dash=(3, 2))
+            item("text_left", "line", text_x_left, text_area_top, text_x_left, iy1, fill="#b35300", dash=(3, 2))
+            item("text_right", "line", text_x_right, text_area_top, text_x_right, iy1, fill="#b35300", dash=(3, 2))
+            item("text_start_label", "text", (text_x_left + text_x_right) / 2, text_start_y - 8, text="Schrift beginnt hier", fill="#b35300", font=("Arial", 8, "bold"))
 
         # Helper to draw extension lines + dimension arrow + centered label
-        def dim_h(xa, xb, y, label):
-            c.create_line(xa, y + 2, xa, y0, fill="#666")
-            c.create_line(xb, y + 2, xb, y0, fill="#666")
-            c.create_line(xa, y, xb, y, fill="#333", arrow=tk.BOTH)
-            c.create_text((xa + xb) / 2, y - 10, text=label, fill="#111", font=("Arial", 8, "bold"))
-
-        def dim_v(x, ya, yb, label):
-            c.create_line(x + 2, ya, x0, ya, fill="#666")
-            c.create_line(x + 2, yb, x0, yb, fill="#666")
-            c.create_line(x, ya, x, yb, fill="#333", arrow=tk.BOTH)
-            c.create_text(x - 20, (ya + yb) / 2, text=label, fill="#111", anchor="e", font=("Arial", 8, "bold"))
+        def dim_h(key, xa, xb, y, label):
+            item((key, "ext_a"), "line", xa, y + 2, xa, y0, fill="#666")
+            item((key, "ext_b"), "line", xb, y + 2, xb, y0, fill="#666")
+            item((key, "arrow"), "line", xa, y, xb, y, fill="#333", arrow=tk.BOTH)
+            item((key, "label"), "text", (xa + xb) / 2, y - 10, text=label, fill="#111", font=("Arial", 8, "bold"))
+
+        def dim_v(key, x, ya, yb, label):
+            item((key, "ext_a"), "line", x + 2, ya, x0, ya, fill="#666")
+            item((key, "ext_b"), "line", x + 2, yb, x0, yb, fill="#666")
+            item((key, "arrow"), "line", x, ya, x, yb, fill="#333", arrow=tk.BOTH)
+            item((key, "label"), "text", x - 20, (ya + yb) / 2, text=label, fill="#111", anchor="e", font=("Arial", 8, "bold"))
 
         # Motif overall size
-        dim_h(x0, x1, y0 - 12, f"Motivbreite {motif_w_mm:.1f} mm")
-        dim_v(x0 - 14, y0, y1, f"Motivhöhe {motif_h_mm:.1f} mm")
+        dim_h("motif_w", x0, x1, y0 - 12, f"Motivbreite {motif_w_mm:.1f} mm")
+        dim_v("motif_h", x0 - 14, y0, y1, f"Motivhöhe {motif_h_mm:.1f} mm")
 
         # Inner image width
-        c.create_line(ix0, y1, ix0, y1 + 30, fill="#666")
-        c.create_line(ix1, y1, ix1, y1 + 30, fill="#666")
-        c.create_line(ix0, y1 + 28, ix1, y1 + 28, fill="#1f77b4", arrow=tk.BOTH)
-        c.create_text((ix0 + ix1) / 2, y1 + 40, text=f"Bildbreite innen {inner_w_mm:.1f} mm", fill="#1f77b4", font=("Arial", 8, "bold"))
+        item("inner_w_ext_a", "line", ix0, y1, ix0, y1 + 30, fill="#666")
+        item("inner_w_ext_b", "line", ix1, y1, ix1, y1 + 30, fill="#666")
+        item("inner_w_arrow", "line", ix0, y1 + 28, ix1, y1 + 28, fill="#1f77b4", arrow=tk.BOTH)
+        item("inner_w_label", "text", (ix0 + ix1) / 2, y1 + 40, text=f"Bildbreite innen {inner_w_mm:.1f} mm", fill="#1f77b4", font=("Arial", 8, "bold"))
 
         # border thickness on top edge
         if border_mm > 0:
-            c.create_line(x0, y0 + 10, ix0, y0 + 10, fill="#444", arrow=tk.BOTH)
-            c.create_text((x0 + ix0) / 2, y0 + 20, text=f"Rahmen {border_mm:.1f} mm", fill="#444", font=("Arial", 8))
-            c.create_text((x0 + ix0) / 2, y0 + 34, text="Fahnen-Rahmen", fill="#444", font=("Arial", 8))
+            item("border_arrow", "line", x0, y0 + 10, ix0, y0 + 10, fill="#444", arrow=tk.BOTH)
+            item("border_label", "text", (x0 + ix0) / 2, y0 + 20, text=f"Rahmen {border_mm:.1f} mm", fill="#444", font=("Arial", 8))
+            item("border_caption", "text", (x0 + ix0) / 2, y0 + 34, text="Fahnen-Rahmen", fill="#444", font=("Arial", 8))
 
         # text area height (if present)
         if has_text:
-            c.create_line(x1 + 8, text_area_top, x1 + 24, text_area_top, fill="#8c6d1f")
-            c.create_line(x1 + 8, iy1, x1 + 24, iy1, fill="#8c6d1f")
-            c.create_line(x1 + 22, text_area_top, x1 + 22, iy1, fill="#8c6d1f", arrow=tk.BOTH)
-            c.create_text(x1 + 28, text_area_top - 6, text=f"Schriftfeld {text_h_mm:.1f} mm", fill="#8c6d1f", anchor="w", font=("Arial", 8, "bold"))
+            item("text_h_ext_a", "line", x1 + 8, text_area_top, x1 + 24, text_area_top, fill="#8c6d1f")
+            item("text_h_ext_b", "line", x1 + 8, iy1, x1 + 24, iy1, fill="#8c6d1f")
+            item("text_h_arrow", "line", x1 + 22, text_area_top, x1 + 22, iy1, fill="#8c6d1f", arrow=tk.BOTH)
+            item("text_h_label", "text", x1 + 28, text_area_top - 6, text=f"Schriftfeld {text_h_mm:.1f} mm", fill="#8c6d1f", anchor="w", font=("Arial", 8, "bold"))
 
             # Side inset dimension
             tx0 = ix0 + side_mm * scale
-            c.create_line(ix0, iy1 + 8, ix0, iy1 + 22, fill="#b35300")
-            c.create_line(tx0, iy1 + 8, tx0, iy1 + 22, fill="#b35300")
-            c.create_line(ix0, iy1 + 20, tx0, iy1 + 20, fill="#b35300", arrow=tk.BOTH)
-            c.create_text((ix0 + tx0) / 2, iy1 + 32, text=f"Einzug {side_mm:.1f} mm", fill="#b35300", font=("Arial", 8))
+            item("side_ext_a", "line", ix0, iy1 + 8, ix0, iy1 + 22, fill="#b35300")
+            item("side_ext_b", "line", tx0, iy1 + 8, tx0, iy1 + 22, fill="#b35300")
+            item("side_arrow", "line", ix0, iy1 + 20, tx0, iy1 + 20, fill="#b35300", arrow=tk.BOTH)
+            item("side_label", "text", (ix0 + tx0) / 2, iy1 + 32, text=f"Einzug {side_mm:.1f} mm", fill="#b35300", font=("Arial", 8))
+
+        # Items not needed for this state (no text, no border, fewer colors) are hidden, not deleted.
+        used = set(self._dim_used)
+        for key, item_id in self._dim_items.items():
+            if key not in used:
+                c.itemconfigure(item_id, state="hidden")
+        # Items created after the first draw were appended on top; restore drawing order.
+        if self._dim_restack and not first_draw:
+            for key in self._dim_used:
+                c.tag_raise(self._dim_items[key])
 
         if hasattr(self, "dim_values_var"):
             lines = [
@@ -259,31 +293,6 @@ class PortraitProApp:
                 lines.append("Schrift:             kein Text gesetzt")
             self.dim_values_var.set("\n".join(lines))
 
-    def _draw_stripes(self, draw, width, height, cols, pcts, border_px=None):
-        curr_y = 0
-        mode = self.config["bund_mode"]
-        for i in range(mode):
-            seg_h = int((pcts[i] / 100.0) * height)
-            y_end = curr_y + seg_h if i < mode - 1 else height
-            if border_px is None:
-                draw.rectangle([0, curr_y, width, y_end], fill=cols[i])
-            else:
-                draw.rectangle([0, curr_y, border_px, y_end], fill=cols[i])
-                draw.rectangle([width - border_px, curr_y, width, y_end], fill=cols[i])
-            curr_y = y_end
-
-    def _resize_cover(self, src_img, target_w, target_h):
-        """Scale image to fully cover target area, then center-crop."""
-        if target_w <= 0 or target_h <= 0:
-            return src_img.copy()
-        scale = max(target_w / src_img.width, target_h / src_img.height)
-        new_w = max(1, int(src_img.width * scale))
-        new_h = max(1, int(src_img.height * scale))
-        resized = src_img.resize((new_w, new_h), Image.Resampling.LANCZOS)
-        left = max(0, (new_w - target_w) // 2)
-        top = max(0, (new_h - target_h) // 2)
-        return resized.crop((left, top, left + target_w, top + target_h))
-
     def init_main_ui(self):
         VERSION = "v1.1.1"
         GITHUB_URL = "https://github.com/georggnt/ahnentafel"
@@ -295,44 +304,28 @@ class PortraitProApp:
         tk.Label(self.toolbar, text=VERSION).pack(side="left", padx=8)
         gh = tk.Label(self.toolbar, text="GitHub", fg="blue", cursor="hand2")
         gh.pack(side="left")
-        gh.bind("<Button-1>", lambda e: webbrowser.open(GITHUB_URL))
+        gh.bind("<Button-1>", lambda e: self._open_url(GITHUB_URL))
 
         self.main_frame = tk.Frame(self.root, padx=10, pady=10)
         self.main_frame.pack(fill="both", expand=True)
 
-        self.MIN_DPI = 300
-        self.DPI = self._find_effective_dpi(
-            self.config.get("canvas_w_mm", 90.0),
-            self.config.get("canvas_h_mm", 130.0),
-            min_dpi=self.MIN_DPI,
-        )
-        self.MM_TO_PX = self.DPI / 25.4
-        # Use ceil so physical print size is never smaller than configured mm values.
-        self.PHOTO_W = self._mm_to_px(self.config["photo_w_mm"], ceil_value=True)
-        self.PHOTO_H = self._mm_to_px(self.config["photo_h_mm"], ceil_value=True)
-        self.CANVAS_W = self._mm_to_px(self.config["canvas_w_mm"], ceil_value=True)
-        self.CANVAS_H = self._mm_to_px(self.config["canvas_h_mm"], ceil_value=True)
+        self._build_engines()
+        preview_w, preview_h = self.preview_renderer.size
 
-        # Make preview large enough to inspect image details on typical screens.
-        self.preview_scale = max(0.30, min(3.00, 420 / max(1, self.PHOTO_H)))
-        
-        # Katheten auf 50% der kürzesten Seite
-        tri_pct = float(self.config.get("triangle_percent", 50.0))
-        self.TRI_SIZE = int(min(self.PHOTO_W, self.PHOTO_H) * (tri_pct / 100.0))
-        
-        self.raw_img, self.current_scale = None, 1.0
+        # source: full-resolution file (decoded lazily); preview_src: reduced decode for the preview
+        self.source, self.preview_src, self.current_scale = None, None, 1.0
         self.pan_x = self.pan_y = 0
         self.last_x = self.last_y = 0
-        self.debounce_id = None
+        # All preview triggers go through the scheduler: at most one render per frame.
+        self.scheduler = RenderScheduler(self.root, self._scheduled_preview, fps=self.store.get_float("preview_fps", RenderScheduler.DEFAULT_FPS))
+        self.preview_worker = PreviewWorker(self.root)
         self._preview_error_shown = False
 
         # UI
         ctrl = tk.Frame(self.main_frame); ctrl.pack(pady=5)
         tk.Button(ctrl, text="Bild laden", command=self.load_image).grid(row=0, column=0, padx=10)
         tk.Label(ctrl, text="Rahmen (mm):").grid(row=0, column=1)
-        min_b = max(0.0, min(MAX_MM_LIMIT, float(self.config.get("border_min_mm", 0.0))))
-        max_b = max(min_b, min(MAX_MM_LIMIT, float(self.config.get("border_max_mm", 7.0))))
-        default_b = max(min_b, min(max_b, float(self.config.get("border_default_mm", 2.3))))
+        min_b, max_b, default_b = self.engine.border_range()
         self.border_val = tk.DoubleVar(value=default_b)
         self.border_scale = tk.Scale(ctrl, from_=min_b, to=max_b, resolution=0.1, orient=tk.HORIZONTAL, variable=self.border_val, command=self.on_setting_change)
         self.border_scale.grid(row=0, column=2, padx=5)
@@ -342,7 +335,7 @@ class PortraitProApp:
         self.border_entry.bind("<Return>", self._on_border_entry)
         self.border_entry.bind("<FocusOut>", self._on_border_entry)
         self.use_triangle_var = tk.BooleanVar(value=False)
-        tk.Checkbutton(ctrl, text="Dreieck", variable=self.use_triangle_var, command=self.update_preview).grid(row=0, column=4)
+        tk.Checkbutton(ctrl, text="Dreieck", variable=self.use_triangle_var, command=self.request_preview).grid(row=0, column=4)
 
         # suggestion placeholder for name text
         self.entry_text = tk.Entry(self.main_frame, width=65)
@@ -362,7 +355,7 @@ class PortraitProApp:
         preview_wrap = tk.Frame(self.main_frame)
         preview_wrap.pack(pady=10)
 
-        self.canvas = tk.Canvas(preview_wrap, width=int(self.PHOTO_W*self.preview_scale), height=int(self.PHOTO_H*self.preview_scale), bg="#eee", highlightthickness=0)
+        self.canvas = tk.Canvas(preview_wrap, width=preview_w, height=preview_h, bg="#eee", highlightthickness=0)
         self.canvas.pack(side="left", padx=(0, 12))
         self.canvas.bind("<B1-Motion>", self.on_drag)
         self.canvas.bind("<Button-1>", self.on_click)
@@ -374,15 +367,57 @@ class PortraitProApp:
         self.dim_values_var = tk.StringVar(value="")
         tk.Label(dim_frame, textvariable=self.dim_values_var, justify="left", anchor="w", font=("Consolas", 9)).pack(fill="x", pady=(6, 0))
 
-        try:
-            self._draw_dimension_info()
-        except Exception:
-            pass
+        # The sketch needs the caption font; draw it once the window is on screen.
+        self.root.after_idle(self._draw_sketch)
 
         tk.Button(self.main_frame, text="Druck-Datei speichern", bg="#007bff", fg="white", command=self.save_check).pack(fill="x")
+        # Exports run in the background; several can be queued.
+        export_frame = tk.Frame(self.main_frame); export_frame.pack(fill="x", pady=(4, 0))
+        self.export_progress = ttk.Progressbar(export_frame, orient=tk.HORIZONTAL, length=160, mode="determinate", maximum=100)
+        self.export_progress.pack(side="left")
+        self.export_status_var = tk.StringVar(value="")
+        self._export_text = ""
+        tk.Label(export_frame, textvariable=self.export_status_var, anchor="w").pack(side="left", fill="x", padx=6)
+
+        # Optional timing readout (config: perf_stats) and JSON-lines log (config: perf_log_file).
+        self.perf_status_var = tk.StringVar(value="")
+        self.perf_label = tk.Label(self.main_frame, textvariable=self.perf_status_var, anchor="w", justify="left", fg="#555", font=("Consolas", 8), wraplength=700)
+        self._apply_perf_settings()
+
+    def _build_engines(self):
+        """(Re)create the engines for the current config; their caches start empty."""
+        self.engine = RenderEngine(self.config)
+        self.DPI = self.engine.DPI
+        self.PHOTO_W = self.engine.PHOTO_W
+        self.PHOTO_H = self.engine.PHOTO_H
+
+        # Make preview large enough to inspect image details on typical screens.
+        self.preview_scale = max(0.30, min(3.00, 420 / max(1, self.PHOTO_H)))
+        # Preview is composed directly at this size; full resolution only on export.
+        self.preview_renderer = PreviewRenderer(self.engine, self.preview_scale)
+
+    def _apply_border_range(self, reset=False):
+        min_b, max_b, default_b = self.engine.border_range()
+        self.border_scale.config(from_=min_b, to=max_b)
+        v = default_b if reset else max(min_b, min(max_b, self.border_val.get()))
+        self.border_val.set(v)
+        self.border_entry_var.set(f"{v:.1f}")
+
+    def _apply_perf_settings(self):
+        show_perf = self.store.get_bool("perf_stats")
+        log_path = self.store.get_str("perf_log_file") or None
+        error = TIMER.configure(enabled=show_perf, log_path=log_path)
+        # Warn once per path; the timer keeps sampling without the log.
+        if error is not None and log_path != getattr(self, "_perf_log_warned", None):
+            self._perf_log_warned = log_path
+            messagebox.showwarning("Performance-Log", f"Die Log-Datei kann nicht geöffnet werden, es wird ohne Log gemessen.\n\nDetails: {error}")
+        if show_perf:
+            self.perf_label.pack(fill="x", pady=(4, 0))
+        else:
+            self.perf_label.pack_forget()
 
     def on_drag(self, e):
-        if not self.raw_img: return
+        if not self.source: return
         # Verschiebung berechnen
         dx = (e.x - self.last_x) / self.preview_scale
         dy = (e.y - self.last_y) / self.preview_scale
@@ -393,116 +428,42 @@ class PortraitProApp:
         
         # --- CLAMPING LOGIK (v1.0.1) ---
         # Verhindert das Schieben über den Bildrand hinaus
-        border_px = self._get_effective_border_px()
-        eff_w = max(1, self.PHOTO_W - (2 * border_px))
-        
-        # Verfügbare Höhe für Foto-Ausschnitt ermitteln
-        text = self._get_effective_text()
-        rect_h = 0
-        if self.text_pos_var.get() == "below" and text != "":
-            _, rect_h, _, _, _, _, _, _, _ = self._calc_text_block(text)
-        
-        eff_h = max(1, self.PHOTO_H - (2 * border_px))
-        avail_h = max(1, eff_h - rect_h)
-        
-        img_w_scaled = self.raw_img.width * self.current_scale
-        img_h_scaled = self.raw_img.height * self.current_scale
-        
-        # Grenzwerte: 0 bis (Skaliertes Bild - Ausschnittgröße)
-        self.pan_x = max(0, min(img_w_scaled - eff_w, new_x))
-        self.pan_y = max(0, min(img_h_scaled - avail_h, new_y))
+        self.pan_x, self.pan_y = self.engine.clamp_pan(self.source.size, self._render_params(), new_x, new_y)
         
         self.last_x, self.last_y = e.x, e.y
-        self.update_preview()
+        self.request_preview()
 
-    def create_final_image(self):
-        border_px = self._get_effective_border_px()
-        eff_w = max(1, self.PHOTO_W - (2 * border_px))
-        eff_h = max(1, self.PHOTO_H - (2 * border_px))
-        bg_w = max(self.CANVAS_W, self.PHOTO_W)
-        bg_h = max(self.CANVAS_H, self.PHOTO_H)
-        text = self._get_effective_text()
-        font, rect_h, _, side_px, bottom_px, _, text_w, _, text_bottom = self._calc_text_block(text)
-        if font is None:
-            font = self._get_text_font(12)
-
-        is_below = self.text_pos_var.get() == "below"
-        avail_h = max(1, eff_h - rect_h) if is_below else eff_h
-        
-        resized = self.raw_img.resize((int(self.raw_img.width * self.current_scale), int(self.raw_img.height * self.current_scale)), Image.Resampling.LANCZOS)
-        crop = resized.crop((int(self.pan_x), int(self.pan_y), int(self.pan_x + eff_w), int(self.pan_y + avail_h)))
-        
-        # Rahmen
-        mode = self.config["bund_mode"]; cols = self.config["colors"]; pcts = self.config["percentages"]
-        bg_source = self.config.get("background_source")
-        if bg_source not in ("colors", "file"):
-            bg_source = "file" if self.config.get("use_background_image", False) else "colors"
-        use_bg = (bg_source == "file")
-        flag_img_photo = None
-        if use_bg and self.config.get("background_image"):
-            try:
-                src = Image.open(self.config.get("background_image")).convert("RGB")
-                flag_img_photo = self._resize_cover(src, self.PHOTO_W, self.PHOTO_H)
-            except Exception:
-                flag_img_photo = None
-
-        # If using background image, paste it as the entire base; otherwise start with white
-        if flag_img_photo:
-            nutz = flag_img_photo.copy()
-        else:
-            nutz = Image.new("RGB", (self.PHOTO_W, self.PHOTO_H), "#FFFFFF")
-        
-        draw_n = ImageDraw.Draw(nutz)
-        
-        # Draw borders (left/right stripes for each color segment OR left/right from background)
-        if not flag_img_photo:
-            self._draw_stripes(draw_n, self.PHOTO_W, self.PHOTO_H, cols, pcts, border_px=border_px)
-        
-        cont = Image.new("RGB", (eff_w, eff_h), "#FFFFFF")
-        cont.paste(crop, (0, 0)); draw_c = ImageDraw.Draw(cont)
-        if text != "":
-            ry0 = eff_h - rect_h
-            draw_c.rectangle([0, ry0, eff_w, eff_h], fill=self.config.get("text_bg_color", "#FFFFFF"))
-            avail_text_w = max(1, eff_w - 2 * side_px)
-            text_left = font.getbbox(text)[0]
-            text_x = side_px + ((avail_text_w - text_w) // 2) - text_left
-            # Place text using actual bbox bottom so descenders are never cut.
-            text_y = eff_h - bottom_px - text_bottom
-            draw_c.text((text_x, text_y), text, fill=self.config.get("text_color", "#000000"), font=font)
-        
-        nutz.paste(cont, (border_px, border_px))
-        if self.use_triangle_var.get():
-            draw_n.polygon([(self.PHOTO_W, 0), (self.PHOTO_W-self.TRI_SIZE, 0), (self.PHOTO_W, self.TRI_SIZE)], fill="#000000")
-            draw_n.line([(self.PHOTO_W-self.TRI_SIZE, 0), (self.PHOTO_W, self.TRI_SIZE)], fill="#FFFFFF", width=1)
-        
-        # Keep exact frame composition size and place it on oversized print canvas.
-        bg = Image.new("RGB", (bg_w, bg_h), "#000000")
-        bg.paste(nutz, (0, 0))
-        return bg
+    @staticmethod
+    def _export_job(engine, source, params, path, report):
+        """Runs on the export thread with a snapshot of the GUI state."""
+        with TIMER.stage("export"):
+            report(0.05, "Laden")
+            # Full decode only here, and only at the resolution the print needs.
+            img, img_params = source.load_for(engine, params)
+            report(0.35, "Rendern")
+            out = engine.render(img, img_params)
+            del img
+            report(0.6, "Speichern")
+            engine.save(out, path)
+            del out
+            # Sidecar with the framing and hashes, for `batch.py rerender`.
+            report(0.9, "Manifest")
+            from render_manifest import write_manifest
+            write_manifest(engine, source, params, path)
 
     def recalc_image_fit(self):
-        if not self.raw_img: return
-        border_px = self._get_effective_border_px()
-        text = self._get_effective_text()
-        rect_h = 0
-        if self.text_pos_var.get() == "below" and text != "":
-            _, rect_h, _, _, _, _, _, _, _ = self._calc_text_block(text)
-        
-        avail_h = max(1, (self.PHOTO_H - 2*border_px) - rect_h)
-        eff_w = max(1, self.PHOTO_W - 2*border_px)
-        ratio_t, ratio_i = eff_w / avail_h, self.raw_img.width / self.raw_img.height
-        self.current_scale = avail_h / self.raw_img.height if ratio_i > ratio_t else eff_w / self.raw_img.width
-        self.pan_x = max(0, min(self.raw_img.width * self.current_scale - eff_w, self.pan_x))
-        self.pan_y = max(0, min(self.raw_img.height * self.current_scale - avail_h, self.pan_y))
-
-    def on_setting_change(self, *a): self.recalc_image_fit(); self.update_preview()
+        if not self.source: return
+        fitted = self.engine.fit(self.source.size, self._render_params())
+        self.current_scale = fitted.scale
+        self.pan_x, self.pan_y = fitted.pan_x, fitted.pan_y
+
+    def on_setting_change(self, *a): self.request_preview(fit=True)
     def _on_border_entry(self, e=None):
         try:
             v = float(self.border_entry_var.get().strip().replace(',','.'))
         except Exception:
             v = self.border_val.get()
-        min_b = max(0.0, min(MAX_MM_LIMIT, float(self.config.get("border_min_mm", 0.0))))
-        max_b = max(min_b, min(MAX_MM_LIMIT, float(self.config.get("border_max_mm", 7.0))))
+        min_b, max_b, _ = self.engine.border_range()
         v = max(min_b, min(max_b, v))
         self.border_val.set(v)
         self.border_entry_var.set(f"{v:.1f}")
@@ -523,37 +484,94 @@ class PortraitProApp:
         return "" if t == getattr(self, '_placeholder_text', '') else t
 
     def on_text_key_release(self, e):
-        # debounce at 500ms to avoid slowdowns
-        if self.debounce_id: self.root.after_cancel(self.debounce_id)
-        self.debounce_id = self.root.after(500, lambda: [self.recalc_image_fit(), self.update_preview()])
+        self.request_preview(fit=True)
     def load_image(self):
         p = filedialog.askopenfilename(); 
-        if p: self.raw_img = Image.open(p).convert("RGB"); self.recalc_image_fit(); self.update_preview()
+        if p:
+            with TIMER.stage("load"):
+                self.source = SourceImage(p)
+                self.recalc_image_fit()
+                self._load_preview_src()
+            self.request_preview()
+
+    def _load_preview_src(self):
+        # Decode only what the preview can show (with the renderer's headroom), all of it for panning.
+        scale = self.current_scale * self.preview_scale * PreviewRenderer.PROXY_HEADROOM
+        self.preview_src = self.source.load(scale, memory_limit=self.engine.memory_limit)
+
     def on_click(self, e): self.last_x, self.last_y = e.x, e.y
-    def update_preview(self):
+    def request_preview(self, fit=False):
+        self.scheduler.request(fit=fit)
+
+    def _scheduled_preview(self, fit):
+        if fit: self.recalc_image_fit()
+        self.update_preview()
+
+    def _draw_sketch(self):
         try:
-            self._draw_dimension_info()
+            with TIMER.stage("sketch"):
+                self._draw_dimension_info()
         except Exception:
             pass
-        if not self.raw_img: return
-        try:
-            p = self.create_final_image().crop((0, 0, self.PHOTO_W, self.PHOTO_H))
-            self._preview_error_shown = False
-        except Exception as ex:
+
+    def update_preview(self):
+        self._draw_sketch()
+        if not self.source: return
+        # Compose off the Tk thread; only the PhotoImage hand-off happens here.
+        renderer, src = self.preview_renderer, self.preview_src
+        params = self.source.params_for(src, self._render_params())
+
+        def job():
+            with TIMER.stage("preview"):
+                return renderer.render(src, params)
+        self.preview_worker.submit(job, self._show_preview)
+
+    def _show_preview(self, p, error):
+        if error is not None:
             # Fallback: show the raw image so preview stays usable even if rendering fails.
-            p = self.raw_img.copy()
+            p = self.preview_src.resize(self.preview_renderer.size, Image.Resampling.LANCZOS)
             if not self._preview_error_shown:
-                messagebox.showwarning("Vorschau-Fehler", f"Die erweiterte Vorschau konnte nicht berechnet werden.\nEs wird eine Fallback-Vorschau angezeigt.\n\nDetails: {ex}")
+                messagebox.showwarning("Vorschau-Fehler", f"Die erweiterte Vorschau konnte nicht berechnet werden.\nEs wird eine Fallback-Vorschau angezeigt.\n\nDetails: {error}")
                 self._preview_error_shown = True
+        else:
+            self._preview_error_shown = False
 
-        self.tk_img = ImageTk.PhotoImage(p.resize((int(self.PHOTO_W*self.preview_scale), int(self.PHOTO_H*self.preview_scale)), Image.Resampling.LANCZOS))
+        from PIL import ImageTk
+        with TIMER.stage("photoimage"):
+            self.tk_img = ImageTk.PhotoImage(p)
         self.canvas.delete("all"); self.canvas.create_image(0, 0, anchor="nw", image=self.tk_img)
+        self._update_perf_status()
+
+    def _update_perf_status(self):
+        if TIMER.enabled:
+            self.perf_status_var.set(TIMER.format_status())
     def save_check(self):
-        if not self.raw_img: return
-        t = self._get_effective_text(); fn = re.sub(r'[^\w\s\.-]', '', t).strip()[:150] or "druck"
-        p = filedialog.asksaveasfilename(initialfile=fn, defaultextension=".jpg")
+        if not self.source: return
+        # A waiting re-fit (caption or border change) must land before the state is snapshotted.
+        self.scheduler.flush()
+        fn = self.engine.suggest_filename(self._get_effective_text())
+        fmt = self.engine.export_format()
+        filetypes = [EXPORT_FILETYPES[fmt]] + [t for f, t in EXPORT_FILETYPES.items() if f != fmt]
+        p = filedialog.asksaveasfilename(initialfile=fn, defaultextension=EXPORT_FORMATS[fmt], filetypes=filetypes)
         if p:
-            dpi_tuple = (int(round(self.DPI)), int(round(self.DPI)))
-            self.create_final_image().save(p, quality=98, dpi=dpi_tuple)
+            # The export thread gets its own engine, the preview/GUI caches stay single-threaded.
+            engine = RenderEngine(self.config)
+            source, params = self.source, self._render_params()
+            self.export_queue.submit(os.path.basename(p), lambda report: self._export_job(engine, source, params, p, report))
+
+    def _on_export_update(self, job, waiting):
+        if not hasattr(self, "export_status_var"):
+            return
+        if job.state == "failed":
+            self._export_text = f"Export fehlgeschlagen: {job.label}"
+            self.export_progress.config(value=0)
+        elif job.state != "queued":
+            self._export_text = f"Gespeichert: {job.label}" if job.state == "done" else f"{job.step or 'Export'}: {job.label}"
+            self.export_progress.config(value=int(job.fraction * 100))
+        queued = f" (+{waiting} wartend)" if waiting else ""
+        self.export_status_var.set(self._export_text + queued)
+        if job.state == "failed":
+            messagebox.showerror("Fehler", f"{job.label} konnte nicht gespeichert werden.\n\nDetails: {job.error}")
+        self._update_perf_status()
 
 
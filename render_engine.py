@@ -0,0 +1,1181 @@
+"""Headless compositing engine for the portrait prints.
+
+Everything in here works from a config dict, a source image and explicit
+render parameters. There is deliberately no tkinter import, so renders can
+run in worker processes, on machines without a display and in benchmarks.
+"""
+import math
+import os
+import re
+import struct
+import threading
+from collections import OrderedDict
+from fractions import Fraction
+from functools import lru_cache
+
+from PIL import Image, ImageColor
+
+from config_handler import EXPORT_FORMATS, GEOMETRY_KEYS, JPEG_SUBSAMPLING, MAX_MM_LIMIT
+from stage_timer import TIMER
+
+TEXT_BELOW = "below"
+TEXT_OVERLAY = "overlay"
+
+# NumPy (optional, ~100 ms) is imported on first use, and ImageDraw/ImageFont
+# where layers and fonts are built, so the GUI can paint before paying for them.
+np = None
+
+
+def numpy_available():
+    """Import NumPy on the first call; False if it is not installed."""
+    global np
+    if np is None:
+        try:
+            import numpy
+        except ImportError:
+            return False
+        np = numpy
+    return True
+
+
+MAX_FONT_SIZE = 400
+
+
+@lru_cache(maxsize=128)
+def load_font(font_name, size):
+    """Load a FreeType font once per (font, size); falls back like the GUI did."""
+    from PIL import ImageFont
+    try:
+        return ImageFont.truetype(font_name, size)
+    except Exception:
+        try:
+            return ImageFont.truetype("arial.ttf", size)
+        except Exception:
+            return ImageFont.load_default()
+
+
+def _text_width(font, text):
+    bbox = font.getbbox(text)
+    return bbox[2] - bbox[0]
+
+
+@lru_cache(maxsize=512)
+def fit_font_size(font_name, text, max_w):
+    """Smallest font size whose caption width reaches ``max_w`` (capped).
+
+    Binary search over the size; the width grows with the size, so this finds
+    the same size as counting up from 1 with a handful of font loads.
+    """
+    lo, hi = 1, MAX_FONT_SIZE
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if _text_width(load_font(font_name, mid), text) >= max_w:
+            hi = mid
+        else:
+            lo = mid + 1
+    return lo
+
+
+FORMAT_BY_EXTENSION = {ext: fmt for fmt, ext in EXPORT_FORMATS.items()}
+FORMAT_BY_EXTENSION.update({".jpeg": "jpeg", ".tiff": "tiff16"})
+
+
+BACKGROUND_CACHE_SIZE = 4
+_backgrounds = OrderedDict()
+_backgrounds_lock = threading.Lock()
+
+
+def load_background(path, size):
+    """Return the coleur background file cover-cropped to ``size``.
+
+    Shared by preview and export engines; an entry is reused until the
+    file's path, mtime or the target size changes. Unreadable files give
+    ``None`` (and are not retried until the file changes).
+    """
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    key = (os.path.abspath(path), mtime, tuple(size))
+    with _backgrounds_lock:
+        if key in _backgrounds:
+            _backgrounds.move_to_end(key)
+            return _backgrounds[key]
+    try:
+        with Image.open(path) as im:
+            layer = RenderEngine.resize_cover(im.convert("RGB"), size[0], size[1])
+    except Exception:
+        layer = None
+    with _backgrounds_lock:
+        _backgrounds[key] = layer
+        while len(_backgrounds) > BACKGROUND_CACHE_SIZE:
+            _backgrounds.popitem(last=False)
+    return layer
+
+
+def save_tiff16(img, path, dpi=300):
+    """Write ``img`` as an uncompressed 16-bit-per-channel RGB TIFF.
+
+    Pillow can only write 8-bit RGB TIFFs, so this is a minimal baseline
+    writer. Every 8-bit value v becomes v * 257 (the byte written twice),
+    which maps 0..255 exactly onto 0..65535.
+    """
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+    w, h = img.size
+    data = img.tobytes()
+    samples = bytearray(2 * len(data))
+    samples[0::2] = data
+    samples[1::2] = data
+
+    tags = 13
+    ifd_size = 2 + 12 * tags + 4
+    bits_at = 8 + ifd_size
+    xres_at = bits_at + 6
+    yres_at = xres_at + 8
+    strip_at = yres_at + 8
+    if strip_at + len(samples) >= 2 ** 32:
+        raise ValueError("Bild zu groß für TIFF")
+
+    def entry(tag, typ, count, value):
+        # SHORT values sit left-aligned in the 4-byte value field.
+        if typ == 3 and count == 1:
+            return struct.pack("<HHIH2x", tag, typ, count, value)
+        return struct.pack("<HHII", tag, typ, count, value)
+
+    ifd = struct.pack("<H", tags) + b"".join((
+        entry(256, 4, 1, w),               # ImageWidth
+        entry(257, 4, 1, h),               # ImageLength
+        entry(258, 3, 3, bits_at),         # BitsPerSample 16,16,16
+        entry(259, 3, 1, 1),               # Compression: none
+        entry(262, 3, 1, 2),               # Photometric: RGB
+        entry(273, 4, 1, strip_at),        # StripOffsets
+        entry(277, 3, 1, 3),               # SamplesPerPixel
+        entry(278, 4, 1, h),               # RowsPerStrip
+        entry(279, 4, 1, len(samples)),    # StripByteCounts
+        entry(282, 5, 1, xres_at),         # XResolution
+        entry(283, 5, 1, yres_at),         # YResolution
+        entry(284, 3, 1, 1),               # PlanarConfiguration: chunky
+        entry(296, 3, 1, 2),               # ResolutionUnit: inch
+    )) + struct.pack("<I", 0)
+    f = path if hasattr(path, "write") else open(path, "wb")
+    try:
+        f.write(b"II*\x00" + struct.pack("<I", 8))
+        f.write(ifd)
+        f.write(struct.pack("<3H", 16, 16, 16))
+        f.write(struct.pack("<2I", int(dpi), 1) * 2)
+        f.write(samples)
+    finally:
+        if f is not path:
+            f.close()
+
+
+def clear_caches():
+    """Drop all module-level caches (fonts, caption sizes, background layers)."""
+    load_font.cache_clear()
+    fit_font_size.cache_clear()
+    with _backgrounds_lock:
+        _backgrounds.clear()
+
+
+class SourceImage:
+    """A source photo that is only decoded at the resolution a render needs.
+
+    Opening reads just the header. ``load(scale)`` decodes for rendering at
+    ``scale`` print pixels per full-resolution source pixel: JPEGs are
+    DCT-scaled while decoding (draft mode), other formats are reduced by an
+    integer factor after decoding. Render parameters always stay relative to
+    the full-resolution ``size``; ``params_for`` maps them onto a decoded image.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with Image.open(path) as im:
+            self.size = im.size
+            self.format = im.format
+
+    @property
+    def width(self):
+        return self.size[0]
+
+    @property
+    def height(self):
+        return self.size[1]
+
+    def load(self, scale=1.0, window=None, memory_limit=None):
+        """Decode for rendering at ``scale``.
+
+        If the whole image and its RGB copy would take more than
+        ``memory_limit`` bytes, only ``window`` (a full-resolution box, see
+        ``RenderEngine.source_window``) is decoded, in bands: each band is
+        converted to RGB and reduced on its own, so the converted full-size
+        image never exists. Uncompressed TIFFs are then only read for the
+        rows of the window and stay within the limit. Every other format
+        (compressed TIFF, PNG, JPEG after draft) has no partial decoder in
+        Pillow and is still decoded once at full size, so the limit is not a
+        hard ceiling for those; only the RGB copy and the reduction are
+        bounded. Pixels inside the window are the same within one 8-bit level.
+        """
+        reduce_by = max(1, int(1.0 / scale)) if scale > 0 else 1
+        target_w = self.size[0] / reduce_by
+        with TIMER.stage("decode"), Image.open(self.path) as im:
+            if reduce_by > 1 and im.format == "JPEG":
+                im.draft("RGB", (max(1, self.size[0] // reduce_by), max(1, self.size[1] // reduce_by)))
+            remaining = max(1, int(im.width / target_w))
+            if memory_limit and _decode_bytes(im, remaining) > memory_limit:
+                return self._load_bands(im, remaining, window, memory_limit)
+            img = im.convert("RGB")
+            if remaining > 1:
+                img = img.reduce(remaining)
+        return img
+
+    def load_for(self, engine, params):
+        """Decode for an export of ``params`` with ``engine``; returns ``(img, img_params)``."""
+        img = self.load(params.scale, engine.source_window(params), engine.memory_limit)
+        return img, self.params_for(img, params)
+
+    def _load_bands(self, im, factor, window, memory_limit):
+        w, h = im.size
+        x0, y0, x1, y1 = 0, 0, w, h
+        if window is not None:
+            # The window is in full-resolution pixels; a JPEG may be drafted smaller.
+            f = self.size[0] / w
+            x0, y0 = max(0, math.floor(window[0] / f)), max(0, math.floor(window[1] / f))
+            x1, y1 = min(w, math.ceil(window[2] / f)), min(h, math.ceil(window[3] / f))
+            if x1 <= x0 or y1 <= y0:
+                x0, y0, x1, y1 = 0, 0, min(w, factor), min(h, factor)
+        # Reduce blocks on the same grid as a reduce of the whole image.
+        x0, y0 = x0 - x0 % factor, y0 - y0 % factor
+        x1, y1 = min(w, -(-x1 // factor) * factor), min(h, -(-y1 // factor) * factor)
+        out = Image.new("RGB", (-(-(x1 - x0) // factor), -(-(y1 - y0) // factor)))
+
+        raw = _raw_rows(im)
+        row_bytes = w * _mode_bytes(im.mode) + (raw[1] if raw else 0) + (x1 - x0) * 4
+        rows = max(factor, memory_limit // 4 // row_bytes // factor * factor)
+        for top in range(y0, y1, rows):
+            bottom = min(y1, top + rows)
+            if raw:
+                offset, stride, rawmode = raw
+                im.fp.seek(offset + top * stride)
+                band = Image.frombytes(im.mode, (w, bottom - top), im.fp.read((bottom - top) * stride), "raw", rawmode)
+                band = band.crop((x0, 0, x1, bottom - top))
+            else:
+                band = im.crop((x0, top, x1, bottom))
+            band = band.convert("RGB")
+            if factor > 1:
+                band = band.reduce(factor)
+            out.paste(band, (0, (top - y0) // factor))
+            del band
+        if (x0, y0, x1, y1) != (0, 0, w, h):
+            # Where the window sits in the image a whole decode would have given.
+            out.info["source_offset"] = (x0 // factor, y0 // factor, -(-w // factor), -(-h // factor))
+        return out
+
+    def params_for(self, img, params):
+        """Return ``params`` with the scale re-expressed for the decoded ``img``."""
+        offset = img.info.get("source_offset")
+        width = offset[2] if offset else img.width
+        return params.copy(scale=params.scale * self.size[0] / width)
+
+
+def _mode_bytes(mode):
+    """Bytes per pixel Pillow uses in memory for ``mode``."""
+    if mode in ("1", "L", "P"):
+        return 1
+    if mode.startswith("I;16"):
+        return 2
+    return 4
+
+
+def _decode_bytes(im, factor):
+    """Peak memory of decoding ``im``, converting it to RGB (always a copy) and reducing by ``factor``."""
+    w, h = im.size
+    return w * h * (_mode_bytes(im.mode) + 4) + (-(-w // factor)) * (-(-h // factor)) * 4
+
+
+def _raw_rows(im):
+    """``(offset, bytes per row, rawmode)`` for an uncompressed single-block TIFF, else ``None``."""
+    if im.format != "TIFF" or len(im.tile) != 1:
+        return None
+    codec, extents, offset, args = im.tile[0]
+    if codec != "raw" or tuple(extents) != (0, 0) + im.size or tuple(args[1:]) != (0, 1):
+        return None
+    bits = im.tag_v2.get(258, (1,))
+    if isinstance(bits, int):
+        bits = (bits,)
+    per_pixel = sum(bits) if len(bits) > 1 else bits[0] * im.tag_v2.get(277, 1)
+    return offset, (im.width * per_pixel + 7) // 8, args[0]
+
+
+class RenderParams:
+    """Per-portrait render state (what the GUI keeps in its Tk variables).
+
+    ``pan_x``/``pan_y`` and ``scale`` refer to the source image scaled into
+    print pixels, exactly like ``PortraitProApp.pan_x``/``current_scale``.
+    """
+
+    FIELDS = ("border_mm", "pan_x", "pan_y", "scale", "text", "text_pos", "triangle")
+
+    def __init__(self, border_mm, pan_x=0.0, pan_y=0.0, scale=1.0, text="", text_pos=TEXT_BELOW, triangle=False):
+        self.border_mm = float(border_mm)
+        self.pan_x = float(pan_x)
+        self.pan_y = float(pan_y)
+        self.scale = float(scale)
+        self.text = text or ""
+        self.text_pos = TEXT_OVERLAY if text_pos == TEXT_OVERLAY else TEXT_BELOW
+        self.triangle = bool(triangle)
+
+    def copy(self, **changes):
+        values = self.to_dict()
+        values.update(changes)
+        return RenderParams(**values)
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**{name: data[name] for name in cls.FIELDS if name in data})
+
+    def __repr__(self):
+        args = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.FIELDS)
+        return f"RenderParams({args})"
+
+
+class LayoutPlan:
+    """Every size, inset and rectangle of one print layout, in pixels and mm.
+
+    A plan depends only on the engine's config, the border, the caption and
+    its position; ``RenderEngine.layout`` builds it once per combination and
+    caches it. Rendering, pan clamping, fitting and the dimension sketch all
+    read from here instead of converting mm and clamping again.
+    """
+
+    def __init__(self, engine, border_mm, text, text_pos):
+        self.border_mm_req = float(border_mm)
+        self.text = text
+        self.text_pos = text_pos
+        self.has_text = text != ""
+
+        # Pixel geometry (what is actually rendered).
+        self.border_px = engine.border_px(border_mm)
+        self.eff_w = max(1, engine.PHOTO_W - (2 * self.border_px))
+        self.eff_h = max(1, engine.PHOTO_H - (2 * self.border_px))
+        self.inner_box = (self.border_px, self.border_px, self.border_px + self.eff_w, self.border_px + self.eff_h)
+        (self.font, self.rect_h, self.font_h, self.side_px, self.bottom_px, self.top_px,
+         self.text_w, self.text_top, self.text_bottom) = engine.calc_text_block(text)
+        self.avail_h = max(1, self.eff_h - self.rect_h) if text_pos == TEXT_BELOW else self.eff_h
+        # Caption band top in inner coordinates (may be negative for huge captions).
+        self.band_top = self.eff_h - self.rect_h
+        self.text_xy = None
+        if self.has_text:
+            avail_text_w = max(1, self.eff_w - 2 * self.side_px)
+            text_left = self.font.getbbox(text)[0]
+            # Place text using actual bbox bottom so descenders are never cut.
+            self.text_xy = (self.side_px + ((avail_text_w - self.text_w) // 2) - text_left,
+                            self.eff_h - self.bottom_px - self.text_bottom)
+
+        # Millimetre geometry (what the dimension sketch shows).
+        self.photo_w_mm, self.photo_h_mm = engine.PHOTO_W_MM, engine.PHOTO_H_MM
+        self.side_mm, self.bottom_mm, self.top_mm = engine.SIDE_MM, engine.BOTTOM_MM, engine.TOP_MM
+        self.border_mm = min(self.border_mm_req, max(0.0, (min(self.photo_w_mm, self.photo_h_mm) - 0.2) / 2.0))
+        self.inner_w_mm = max(0.0, self.photo_w_mm - 2 * self.border_mm)
+        self.inner_h_mm = max(0.0, self.photo_h_mm - 2 * self.border_mm)
+        show_text = self.has_text and self.rect_h > 0
+        self.text_h_mm = engine.px_to_mm(self.rect_h) if show_text else 0.0
+        self.font_h_mm = engine.px_to_mm(self.font_h) if show_text else 0.0
+
+    def window_box(self, pan_x, pan_y):
+        """Box of the scaled source shown in the photo area for this pan."""
+        return (int(pan_x), int(pan_y), int(pan_x + self.eff_w), int(pan_y + self.avail_h))
+
+
+class RenderEngine:
+    MIN_DPI = 300
+
+    # Number of scaled source levels kept when ``cache_levels`` is enabled.
+    LEVEL_CACHE_SIZE = 2
+    TEXT_BLOCK_CACHE_SIZE = 32
+    LAYOUT_CACHE_SIZE = 32
+    STATIC_CACHE_SIZE = 4
+    # Output images in rotation when ``reuse_buffers`` is enabled.
+    OUTPUT_BUFFERS = 2
+    # The config keys each cache is built from; ``reconfigure`` drops only the affected ones.
+    CACHE_KEYS = (
+        (frozenset({"text_font", "fixed_distance_mm", "fixed_bottom_mm", "fixed_top_p_mm"}),
+         ("_text_blocks", "_layouts", "_bands", "_np_bands")),
+        (frozenset({"text_bg_color", "text_color"}), ("_bands", "_np_bands")),
+        (frozenset({"bund_mode", "colors", "percentages", "background_source", "use_background_image", "background_image"}),
+         ("_frames", "_np_frames")),
+        (frozenset({"triangle_percent"}), ("_triangle", "_np_triangle")),
+    )
+
+    def __init__(self, config, pixel_scale=1.0, cache_levels=False, compositor=None, reuse_buffers=False):
+        """``pixel_scale`` < 1 lays the whole composition out at a reduced
+        resolution (preview); ``DPI`` always stays the print resolution.
+
+        With ``cache_levels`` the resampled source is kept per scale, so
+        repeated renders that only pan cost a crop. Without it, only the
+        visible window is resampled (best for one-shot exports).
+
+        ``compositor`` overrides the config key of the same name
+        (``pillow`` or ``numpy``); see ``set_compositor``.
+
+        With ``reuse_buffers`` renders are written into a fixed rotation of
+        ``OUTPUT_BUFFERS`` preallocated images instead of a fresh copy each
+        time. A returned image then stays valid only until the render after
+        next: enough for a worker handing one result to the Tk thread while
+        it renders the next, or for render-then-save loops.
+        """
+        self.config = config
+        self.pixel_scale = float(pixel_scale)
+        self.cache_levels = cache_levels
+        self.reuse_buffers = reuse_buffers
+        self._out_buffers = {}
+        self.set_compositor(compositor or config.get("compositor", "pillow"))
+        self._np_frames = OrderedDict()
+        self._np_bands = OrderedDict()
+        self._np_triangle = None
+        self._np_buffers = {}
+        self._levels = OrderedDict()
+        self._text_blocks = OrderedDict()
+        self._layouts = OrderedDict()
+        self._frames = OrderedDict()
+        self._bands = OrderedDict()
+        self._triangle = None
+        self.DPI = self.find_effective_dpi(
+            config.get("canvas_w_mm", 90.0),
+            config.get("canvas_h_mm", 130.0),
+            min_dpi=self.MIN_DPI,
+        )
+        self.MM_TO_PX = self.DPI * self.pixel_scale / 25.4
+        # Use ceil so physical print size is never smaller than configured mm values.
+        self.PHOTO_W = self.mm_to_px(config["photo_w_mm"], ceil_value=True)
+        self.PHOTO_H = self.mm_to_px(config["photo_h_mm"], ceil_value=True)
+        self.CANVAS_W = self.mm_to_px(config["canvas_w_mm"], ceil_value=True)
+        self.CANVAS_H = self.mm_to_px(config["canvas_h_mm"], ceil_value=True)
+        self.PHOTO_W_MM = float(config.get("photo_w_mm", 70.0))
+        self.PHOTO_H_MM = float(config.get("photo_h_mm", 90.0))
+        self.MAX_BORDER_PX = max(0, (min(self.PHOTO_W, self.PHOTO_H) - 2) // 2)
+        self._apply_settings()
+
+    def _apply_settings(self):
+        """Everything derived from the config except the geometry (see ``reconfigure``)."""
+        config = self.config
+        # Katheten auf 50% der kürzesten Seite
+        tri_pct = float(config.get("triangle_percent", 50.0))
+        self.TRI_SIZE = int(min(self.PHOTO_W, self.PHOTO_H) * (tri_pct / 100.0))
+
+        # Caption insets and border limits only depend on the config.
+        self.SIDE_MM = self._inset_mm("fixed_distance_mm", 6.0)
+        self.BOTTOM_MM = self._inset_mm("fixed_bottom_mm", 6.0)
+        self.TOP_MM = self._inset_mm("fixed_top_p_mm", 1.0)
+        self.SIDE_PX = self.mm_to_px(self.SIDE_MM)
+        self.BOTTOM_PX = self.mm_to_px(self.BOTTOM_MM)
+        self.TOP_PX = self.mm_to_px(self.TOP_MM)
+        min_b = self._inset_mm("border_min_mm", 0.0)
+        max_b = max(min_b, min(MAX_MM_LIMIT, float(config.get("border_max_mm", 7.0))))
+        self.BORDER_RANGE = (min_b, max_b, max(min_b, min(max_b, float(config.get("border_default_mm", 2.3)))))
+        # Decode budget per source image in bytes (0: none); only uncompressed TIFFs
+        # are held to it strictly, see SourceImage.load.
+        self.memory_limit = int(max(0.0, float(config.get("memory_limit_mb", 0) or 0)) * 1024 * 1024)
+
+    def reconfigure(self, config, changed):
+        """Switch to ``config`` in place, dropping only the caches built from ``changed`` keys.
+
+        Geometry keys change the resolution of everything; those need a new engine.
+        """
+        if changed & GEOMETRY_KEYS:
+            raise ValueError("Geometrie geändert: neue RenderEngine nötig")
+        self.config = config
+        self._apply_settings()
+        if "compositor" in changed:
+            self.set_compositor(config.get("compositor", "pillow"))
+        for keys, caches in self.CACHE_KEYS:
+            if changed & keys:
+                for name in caches:
+                    cache = getattr(self, name)
+                    if isinstance(cache, OrderedDict):
+                        cache.clear()
+                    else:
+                        setattr(self, name, None)
+
+    def set_compositor(self, name):
+        """Switch between the Pillow and the NumPy compositor at runtime.
+
+        Both give identical pixels. Without NumPy installed, ``numpy``
+        quietly stays on Pillow; ``compositor`` tells which one is active.
+        """
+        self.compositor = "numpy" if name == "numpy" and numpy_available() else "pillow"
+
+    # --- units -----------------------------------------------------------
+
+    def mm_to_px(self, mm_value, ceil_value=False):
+        px = float(mm_value) * self.MM_TO_PX
+        if ceil_value:
+            return max(1, int(math.ceil(px - 1e-9)))
+        return max(1, int(round(px)))
+
+    def px_to_mm(self, px):
+        return px / self.MM_TO_PX
+
+    @staticmethod
+    def find_effective_dpi(width_mm, height_mm, min_dpi=300, max_dpi=1200):
+        """Pick the smallest DPI >= min_dpi that maps both mm sides to integer pixels.
+
+        ``mm / 25.4 * dpi`` is an integer exactly when ``dpi`` is a multiple
+        of the denominator of the reduced fraction ``mm / 25.4``, so the
+        answer is the first multiple of the lcm of both denominators.
+        """
+        start = max(1, int(math.ceil(float(min_dpi))))
+        w_mm = float(width_mm)
+        h_mm = float(height_mm)
+        if w_mm <= 0 or h_mm <= 0:
+            return float(start)
+
+        inch = Fraction("25.4")
+        # str() gives the shortest decimal of the float, i.e. what the user typed.
+        step = math.lcm(*((Fraction(str(mm)) / inch).denominator for mm in (w_mm, h_mm)))
+        dpi = -(-start // step) * step
+        return float(dpi) if dpi <= max_dpi else float(start)
+
+    def _inset_mm(self, key, default):
+        return max(0.0, min(MAX_MM_LIMIT, float(self.config.get(key, default))))
+
+    # --- text ------------------------------------------------------------
+
+    def font_name(self):
+        return self.config.get("text_font", "arial.ttf") or "arial.ttf"
+
+    def get_text_font(self, size):
+        return load_font(self.font_name(), size)
+
+    def text_max_width(self):
+        return max(1, self.PHOTO_W - 2 * self.SIDE_PX - 2)
+
+    def calc_text_font(self, text):
+        if not text:
+            return self.get_text_font(12)
+        return self.get_text_font(fit_font_size(self.font_name(), text, self.text_max_width()))
+
+    def calc_text_block(self, text):
+        if not text:
+            return None, 0, 0, 0, 0, 0, 0, 0, 0
+        block = self._text_blocks.get(text)
+        if block is not None:
+            self._text_blocks.move_to_end(text)
+            return block
+        font = self.calc_text_font(text)
+        bbox = font.getbbox(text)
+        font_h = bbox[3] - bbox[1]
+        text_w = bbox[2] - bbox[0]
+        text_top = bbox[1]
+        text_bottom = bbox[3]
+        # Small safety padding prevents anti-aliased glyph pixels from being clipped.
+        rect_h = font_h + self.BOTTOM_PX + self.TOP_PX + 2
+        block = (font, rect_h, font_h, self.SIDE_PX, self.BOTTOM_PX, self.TOP_PX, text_w, text_top, text_bottom)
+        self._text_blocks[text] = block
+        while len(self._text_blocks) > self.TEXT_BLOCK_CACHE_SIZE:
+            self._text_blocks.popitem(last=False)
+        return block
+
+    # --- geometry --------------------------------------------------------
+
+    def border_range(self):
+        """Return (min, max, default) border in mm as offered by the slider."""
+        return self.BORDER_RANGE
+
+    def border_px(self, border_mm):
+        return max(0, min(int(float(border_mm) * self.MM_TO_PX), self.MAX_BORDER_PX))
+
+    def layout(self, border_mm, text="", text_pos=TEXT_BELOW):
+        """Return the cached LayoutPlan for this border, caption and position."""
+        key = (float(border_mm), text, text_pos)
+        plan = self._layouts.get(key)
+        if plan is not None:
+            self._layouts.move_to_end(key)
+            return plan
+        return self._cache_put(self._layouts, key, LayoutPlan(self, border_mm, text, text_pos), self.LAYOUT_CACHE_SIZE)
+
+    def plan_for(self, params):
+        return self.layout(params.border_mm, params.text, params.text_pos)
+
+    def clamp_pan(self, src_size, params, pan_x, pan_y):
+        """Keep the visible window inside the scaled source image."""
+        plan = self.plan_for(params)
+        img_w_scaled = src_size[0] * params.scale
+        img_h_scaled = src_size[1] * params.scale
+        # Grenzwerte: 0 bis (Skaliertes Bild - Ausschnittgröße)
+        pan_x = max(0, min(img_w_scaled - plan.eff_w, pan_x))
+        pan_y = max(0, min(img_h_scaled - plan.avail_h, pan_y))
+        return pan_x, pan_y
+
+    def source_window(self, params):
+        """Full-resolution source box that the photo area of ``params`` is resampled from."""
+        x0, y0, x1, y1 = self.plan_for(params).window_box(params.pan_x, params.pan_y)
+        # Lanczos reads 3 output pixels to each side, and at least 3 source pixels when enlarging.
+        s = params.scale
+        margin = 4.0 / s + 4
+        return (math.floor(x0 / s - margin), math.floor(y0 / s - margin),
+                math.ceil(x1 / s + margin), math.ceil(y1 / s + margin))
+
+    def fit(self, src_size, params):
+        """Return params with the cover scale for ``src_size`` and a clamped pan."""
+        plan = self.plan_for(params)
+        eff_w, avail_h = plan.eff_w, plan.avail_h
+        src_w, src_h = src_size
+        ratio_t, ratio_i = eff_w / avail_h, src_w / src_h
+        scale = avail_h / src_h if ratio_i > ratio_t else eff_w / src_w
+        fitted = params.copy(scale=scale)
+        fitted.pan_x, fitted.pan_y = self.clamp_pan(src_size, fitted, params.pan_x, params.pan_y)
+        return fitted
+
+    # --- compositing -----------------------------------------------------
+
+    def draw_stripes(self, draw, width, height, cols, pcts, border_px=None):
+        curr_y = 0
+        mode = self.config["bund_mode"]
+        for i in range(mode):
+            seg_h = int((pcts[i] / 100.0) * height)
+            y_end = curr_y + seg_h if i < mode - 1 else height
+            if border_px is None:
+                draw.rectangle([0, curr_y, width, y_end], fill=cols[i])
+            else:
+                draw.rectangle([0, curr_y, border_px, y_end], fill=cols[i])
+                draw.rectangle([width - border_px, curr_y, width, y_end], fill=cols[i])
+            curr_y = y_end
+
+    @staticmethod
+    def resize_cover(src_img, target_w, target_h):
+        """Scale image to fully cover target area, then center-crop."""
+        if target_w <= 0 or target_h <= 0:
+            return src_img.copy()
+        scale = max(target_w / src_img.width, target_h / src_img.height)
+        new_w = max(1, int(src_img.width * scale))
+        new_h = max(1, int(src_img.height * scale))
+        resized = src_img.resize((new_w, new_h), Image.Resampling.LANCZOS)
+        left = max(0, (new_w - target_w) // 2)
+        top = max(0, (new_h - target_h) // 2)
+        return resized.crop((left, top, left + target_w, top + target_h))
+
+    def scaled_level(self, src, scale):
+        """Return ``src`` LANCZOS-resized by ``scale``, cached per (source, size)."""
+        size = (int(src.width * scale), int(src.height * scale))
+        key = (id(src), size)
+        entry = self._levels.get(key)
+        if entry is not None and entry[0] is src:
+            self._levels.move_to_end(key)
+            return entry[1]
+        level = src.resize(size, Image.Resampling.LANCZOS)
+        # The third slot holds the level as an array once the numpy compositor asks for it.
+        self._levels[key] = [src, level, None]
+        while len(self._levels) > self.LEVEL_CACHE_SIZE:
+            self._levels.popitem(last=False)
+        return level
+
+    def scaled_crop(self, src, scale, box):
+        """Equivalent of ``src.resize(scaled size).crop(box)``.
+
+        Areas of ``box`` outside the scaled image come back black, exactly
+        like ``Image.crop``. Without the level cache, only the source window
+        behind ``box`` is resampled. Sample positions and filter support are
+        those of the full resize; rounding can differ by up to two 8-bit levels.
+        A window decoded by ``SourceImage.load`` is resampled as the part of
+        the whole image it came from.
+        """
+        offset = src.info.get("source_offset")
+        if self.cache_levels and offset is None:
+            return self.scaled_level(src, scale).crop(box)
+
+        ox, oy, full_w, full_h = offset or (0, 0, src.width, src.height)
+        new_w, new_h = int(full_w * scale), int(full_h * scale)
+        x0, y0, x1, y1 = box
+        ix0, iy0 = max(0, x0), max(0, y0)
+        ix1, iy1 = min(new_w, x1), min(new_h, y1)
+        if ix1 <= ix0 or iy1 <= iy0:
+            return Image.new("RGB", (x1 - x0, y1 - y0), "#000000")
+        sx = full_w / new_w
+        sy = full_h / new_h
+        part = src.resize(
+            (ix1 - ix0, iy1 - iy0),
+            Image.Resampling.LANCZOS,
+            box=(max(0.0, ix0 * sx - ox), max(0.0, iy0 * sy - oy),
+                 min(src.width, ix1 * sx - ox), min(src.height, iy1 * sy - oy)),
+        )
+        if part.size == (x1 - x0, y1 - y0):
+            return part
+        out = Image.new("RGB", (x1 - x0, y1 - y0), "#000000")
+        out.paste(part, (ix0 - x0, iy0 - y0))
+        return out
+
+    def _level_array(self, src, scale):
+        """The cached scaled level as an array (numpy compositor with ``cache_levels``)."""
+        self.scaled_level(src, scale)
+        entry = self._levels[(id(src), (int(src.width * scale), int(src.height * scale)))]
+        if entry[2] is None:
+            entry[2] = np.asarray(entry[1])
+        return entry[2]
+
+    def _output_buffer(self, frame_only):
+        """Next image of the ``reuse_buffers`` rotation, (re)allocated on size change."""
+        size = (self.PHOTO_W, self.PHOTO_H) if frame_only else (max(self.CANVAS_W, self.PHOTO_W), max(self.CANVAS_H, self.PHOTO_H))
+        ring = self._out_buffers.get(frame_only)
+        if ring is None or ring[0].size != size:
+            # Black = the oversize canvas; renders only ever rewrite the frame area.
+            ring = self._out_buffers[frame_only] = [Image.new("RGB", size, "#000000") for _ in range(self.OUTPUT_BUFFERS)]
+        ring.append(ring.pop(0))
+        return ring[-1]
+
+    def background_source(self):
+        bg_source = self.config.get("background_source")
+        if bg_source not in ("colors", "file"):
+            bg_source = "file" if self.config.get("use_background_image", False) else "colors"
+        return bg_source
+
+    def _cache_put(self, cache, key, value, size):
+        cache[key] = value
+        while len(cache) > size:
+            cache.popitem(last=False)
+        return value
+
+    def _frame_layer(self, plan):
+        """Frame base: coleur stripes (or background file) with a white inner area.
+
+        Depends only on config and border, so it is built once per border.
+        """
+        border_px = plan.border_px
+        flag_img_photo = None
+        if self.background_source() == "file" and self.config.get("background_image"):
+            flag_img_photo = load_background(self.config.get("background_image"), (self.PHOTO_W, self.PHOTO_H))
+        key = (border_px, id(flag_img_photo))
+        entry = self._frames.get(key)
+        if entry is not None and entry[0] is flag_img_photo:
+            self._frames.move_to_end(key)
+            return entry[1], entry[2]
+
+        # If using background image, paste it as the entire base; otherwise start with white
+        if flag_img_photo:
+            nutz = flag_img_photo.copy()
+        else:
+            nutz = Image.new("RGB", (self.PHOTO_W, self.PHOTO_H), "#FFFFFF")
+            # Draw borders (left/right stripes for each color segment)
+            from PIL import ImageDraw
+            self.draw_stripes(ImageDraw.Draw(nutz), self.PHOTO_W, self.PHOTO_H, self.config["colors"], self.config["percentages"], border_px=border_px)
+
+        nutz.paste(Image.new("RGB", (plan.eff_w, plan.eff_h), "#FFFFFF"), plan.inner_box[:2])
+
+        # Keep exact frame composition size and place it on oversized print canvas.
+        bg = Image.new("RGB", (max(self.CANVAS_W, self.PHOTO_W), max(self.CANVAS_H, self.PHOTO_H)), "#000000")
+        bg.paste(nutz, (0, 0))
+        self._cache_put(self._frames, key, (flag_img_photo, nutz, bg), self.STATIC_CACHE_SIZE)
+        return nutz, bg
+
+    def _text_layer(self, plan):
+        """Caption band (background rectangle plus glyphs) and its frame position."""
+        key = (plan.border_px, plan.text)
+        if key in self._bands:
+            self._bands.move_to_end(key)
+            return self._bands[key]
+        eff_w, eff_h, ry0 = plan.eff_w, plan.eff_h, plan.band_top
+        # The band is clipped to the inner area, exactly as when drawn into it.
+        top = max(0, ry0)
+        band = Image.new("RGB", (eff_w, eff_h - top), "#FFFFFF")
+        from PIL import ImageDraw
+        draw_b = ImageDraw.Draw(band)
+        draw_b.rectangle([0, ry0 - top, eff_w, eff_h - top], fill=self.config.get("text_bg_color", "#FFFFFF"))
+        text_x, text_y = plan.text_xy
+        draw_b.text((text_x, text_y - top), plan.text, fill=self.config.get("text_color", "#000000"), font=plan.font)
+        return self._cache_put(self._bands, key, (band, (plan.border_px, plan.border_px + top)), self.STATIC_CACHE_SIZE)
+
+    def _triangle_layer(self):
+        """Corner triangle as a small image, paste mask and frame position."""
+        if self._triangle is None:
+            size = (self.PHOTO_W, self.PHOTO_H)
+            corner = [(self.PHOTO_W, 0), (self.PHOTO_W-self.TRI_SIZE, 0), (self.PHOTO_W, self.TRI_SIZE)]
+            hyp = [(self.PHOTO_W-self.TRI_SIZE, 0), (self.PHOTO_W, self.TRI_SIZE)]
+            tri = Image.new("RGB", size, "#000000")
+            mask = Image.new("L", size, 0)
+            from PIL import ImageDraw
+            draw_t, draw_m = ImageDraw.Draw(tri), ImageDraw.Draw(mask)
+            draw_t.polygon(corner, fill="#000000"); draw_m.polygon(corner, fill=255)
+            draw_t.line(hyp, fill="#FFFFFF", width=1); draw_m.line(hyp, fill=255, width=1)
+            box = mask.getbbox() or (0, 0, 1, 1)
+            self._triangle = (tri.crop(box), mask.crop(box), box[:2])
+        return self._triangle
+
+    def render(self, src, params, frame_only=False):
+        """Compose the print image: the frame on the oversize black canvas.
+
+        Stripes, caption band and triangle come from cached layers, so a
+        render that only pans costs one photo crop plus a few pastes.
+        With ``frame_only`` the exact frame (PHOTO_W x PHOTO_H) is returned.
+        """
+        return self._compose(src, params, None, (0, 0), frame_only)
+
+    def render_into(self, dest, offset, src, params):
+        """Compose the exact frame straight into ``dest`` with its corner at ``offset``.
+
+        Used for print sheets, so no per-portrait canvas is allocated.
+        """
+        return self._compose(src, params, dest, offset, True)
+
+    def _compose(self, src, params, dest, offset, frame_only):
+        if self.compositor == "numpy":
+            out = self._compose_numpy(src, params, frame_only or dest is not None)
+            if dest is None:
+                return out
+            with TIMER.stage("composite"):
+                dest.paste(out, offset)
+            return dest
+
+        with TIMER.stage("text"):
+            plan = self.plan_for(params)
+            band = self._text_layer(plan) if plan.has_text else None
+
+        with TIMER.stage("resize"):
+            crop = self.scaled_crop(src, params.scale, plan.window_box(params.pan_x, params.pan_y))
+
+        with TIMER.stage("stripes"):
+            nutz, bg = self._frame_layer(plan)
+        with TIMER.stage("composite"):
+            ox, oy = offset
+            if dest is None and self.reuse_buffers:
+                dest = self._output_buffer(frame_only)
+                dest.paste(nutz, (0, 0))
+            elif dest is None:
+                dest = (nutz if frame_only else bg).copy()
+            else:
+                dest.paste(nutz, offset)
+            dest.paste(crop, (ox + plan.border_px, oy + plan.border_px))
+            if band is not None:
+                band_img, (bx, by) = band
+                dest.paste(band_img, (ox + bx, oy + by))
+            if params.triangle:
+                tri, mask, (tx, ty) = self._triangle_layer()
+                dest.paste(tri, (ox + tx, oy + ty), mask)
+        return dest
+
+    # --- numpy compositor --------------------------------------------------
+
+    def _np_frame(self, plan):
+        """Frame base (stripes or background file, white inner area) as an array."""
+        flag_img_photo = None
+        if self.background_source() == "file" and self.config.get("background_image"):
+            flag_img_photo = load_background(self.config.get("background_image"), (self.PHOTO_W, self.PHOTO_H))
+        key = (plan.border_px, id(flag_img_photo))
+        entry = self._np_frames.get(key)
+        if entry is not None and entry[0] is flag_img_photo:
+            self._np_frames.move_to_end(key)
+            return entry[1]
+
+        w, h, b = self.PHOTO_W, self.PHOTO_H, plan.border_px
+        if flag_img_photo:
+            frame = np.array(flag_img_photo)
+        else:
+            frame = np.full((h, w, 3), 255, np.uint8)
+            # Same segments as draw_stripes; ImageDraw rectangles include both edges.
+            cols, pcts = self.config["colors"], self.config["percentages"]
+            mode = self.config["bund_mode"]
+            curr_y = 0
+            for i in range(mode):
+                seg_h = int((pcts[i] / 100.0) * h)
+                y_end = curr_y + seg_h if i < mode - 1 else h
+                rgb = ImageColor.getcolor(cols[i], "RGB")
+                frame[curr_y:y_end + 1, :b + 1] = rgb
+                frame[curr_y:y_end + 1, w - b:] = rgb
+                curr_y = y_end
+        frame[b:b + plan.eff_h, b:b + plan.eff_w] = 255
+        self._cache_put(self._np_frames, key, (flag_img_photo, frame), self.STATIC_CACHE_SIZE)
+        return frame
+
+    def _np_band(self, plan):
+        """Caption band as an array; glyphs are still rasterized by Pillow (once)."""
+        key = (plan.border_px, plan.text)
+        if key in self._np_bands:
+            self._np_bands.move_to_end(key)
+            return self._np_bands[key]
+        band, pos = self._text_layer(plan)
+        return self._cache_put(self._np_bands, key, (np.asarray(band), pos), self.STATIC_CACHE_SIZE)
+
+    def _np_triangle_layer(self):
+        """Triangle pixels as (array, row spans, position).
+
+        The mask is drawn without anti-aliasing (strictly 0 or 255) and each
+        of its rows is one run, so the paste becomes one slice copy per row.
+        """
+        if self._np_triangle is None:
+            tri, mask, pos = self._triangle_layer()
+            mask = np.asarray(mask) > 0
+            spans = []
+            for y, row in enumerate(mask):
+                xs = np.flatnonzero(row)
+                if len(xs) and xs[-1] - xs[0] + 1 != len(xs):
+                    spans = mask[..., None]  # not a single run: masked copy instead
+                    break
+                if len(xs):
+                    spans.append((y, int(xs[0]), int(xs[-1]) + 1))
+            self._np_triangle = (np.asarray(tri), spans, pos)
+        return self._np_triangle
+
+    def _np_buffer(self, frame_only):
+        """Output array, allocated once per engine and output size."""
+        shape = (self.PHOTO_H, self.PHOTO_W, 3) if frame_only else (max(self.CANVAS_H, self.PHOTO_H), max(self.CANVAS_W, self.PHOTO_W), 3)
+        buf = self._np_buffers.get(frame_only)
+        if buf is None or buf.shape != shape:
+            # Zero = the black oversize canvas; only the frame area is rewritten per render.
+            buf = self._np_buffers[frame_only] = np.zeros(shape, np.uint8)
+        return buf
+
+    @staticmethod
+    def _np_copy_window(dest, level, box):
+        """``dest[...] = level.crop(box)`` without the crop; outside the level is black."""
+        x0, y0, x1, y1 = box
+        h, w = level.shape[:2]
+        ix0, iy0, ix1, iy1 = max(0, x0), max(0, y0), min(w, x1), min(h, y1)
+        if ix0 > x0 or iy0 > y0 or ix1 < x1 or iy1 < y1:
+            dest[...] = 0
+        if ix1 > ix0 and iy1 > iy0:
+            dest[iy0 - y0:iy1 - y0, ix0 - x0:ix1 - x0] = level[iy0:iy1, ix0:ix1]
+
+    def _compose_numpy(self, src, params, frame_only):
+        """Array version of ``_compose``: slices into one reused buffer.
+
+        Pillow keeps RGB as 4 bytes per pixel internally, so the result
+        cannot be shared zero-copy; ``fromarray`` packs it once. With
+        ``cache_levels`` the photo window is copied from a view of the
+        cached level, otherwise the crop is read once into the buffer.
+        """
+        with TIMER.stage("text"):
+            plan = self.plan_for(params)
+            band = self._np_band(plan) if plan.has_text else None
+
+        box = plan.window_box(params.pan_x, params.pan_y)
+        with TIMER.stage("resize"):
+            if self.cache_levels and "source_offset" not in src.info:
+                # Panning reads straight from the cached level: no crop image at all.
+                level, crop = self._level_array(src, params.scale), None
+            else:
+                crop = np.asarray(self.scaled_crop(src, params.scale, box))
+
+        with TIMER.stage("stripes"):
+            frame = self._np_frame(plan)
+        with TIMER.stage("composite"):
+            buf = self._np_buffer(frame_only)
+            b = plan.border_px
+            buf[:self.PHOTO_H, :self.PHOTO_W] = frame
+            # Box size, not window size: like Image.paste of the crop (they differ only for negative pans).
+            photo = buf[b:b + box[3] - box[1], b:b + box[2] - box[0]]
+            if crop is not None:
+                photo[...] = crop
+            else:
+                self._np_copy_window(photo, level, box)
+            if band is not None:
+                band_arr, (bx, by) = band
+                buf[by:by + band_arr.shape[0], bx:bx + band_arr.shape[1]] = band_arr
+            if params.triangle:
+                tri, spans, (tx, ty) = self._np_triangle_layer()
+                if isinstance(spans, list):
+                    for y, x0, x1 in spans:
+                        buf[ty + y, tx + x0:tx + x1] = tri[y, x0:x1]
+                else:
+                    np.copyto(buf[ty:ty + tri.shape[0], tx:tx + tri.shape[1]], tri, where=spans)
+            return Image.fromarray(buf)
+
+    @staticmethod
+    def suggest_filename(text):
+        return re.sub(r'[^\w\s\.-]', '', text).strip()[:150] or "druck"
+
+    def export_format(self, path=None):
+        """Format for ``path``: its extension wins, otherwise the config.
+
+        ``None`` means an extension outside EXPORT_FORMATS (e.g. ``.bmp``),
+        which is left to Pillow.
+        """
+        ext = os.path.splitext(path or "")[1].lower()
+        if ext:
+            return FORMAT_BY_EXTENSION.get(ext)
+        fmt = self.config.get("export_format", "jpeg")
+        return fmt if fmt in EXPORT_FORMATS else "jpeg"
+
+    def export_extension(self):
+        return EXPORT_FORMATS[self.export_format()]
+
+    def jpeg_options(self):
+        options = {
+            "quality": max(1, min(100, int(self.config.get("jpeg_quality", 98)))),
+            "optimize": bool(self.config.get("jpeg_optimize", False)),
+            "progressive": bool(self.config.get("jpeg_progressive", False)),
+        }
+        subsampling = self.config.get("jpeg_subsampling", "auto")
+        if subsampling in JPEG_SUBSAMPLING and subsampling != "auto":
+            options["subsampling"] = subsampling
+        return options
+
+    def save(self, img, path):
+        """Encode with the configured options; the file extension picks the format.
+
+        ``path`` may also be a binary file object, which gets the configured format.
+        """
+        dpi = int(round(self.DPI))
+        fmt = self.export_format(path if isinstance(path, (str, os.PathLike)) else None)
+        with TIMER.stage("encode"):
+            if fmt is None:
+                img.save(path, dpi=(dpi, dpi))
+            elif fmt == "tiff16":
+                save_tiff16(img, path, dpi)
+            elif fmt == "png":
+                level = max(0, min(9, int(self.config.get("png_compress_level", 6))))
+                img.save(path, format="PNG", dpi=(dpi, dpi), compress_level=level)
+            else:
+                options = self.jpeg_options()
+                try:
+                    img.save(path, format="JPEG", dpi=(dpi, dpi), **options)
+                except OSError:
+                    if not (options["optimize"] or options["progressive"]):
+                        raise
+                    # Pillow encodes optimized/progressive JPEGs in one fixed-size buffer,
+                    # which extreme grain at high quality can overflow; store it baseline.
+                    options.update(optimize=False, progressive=False)
+                    img.save(path, format="JPEG", dpi=(dpi, dpi), **options)
+
+    def render_frame(self, src, params):
+        """Render only the exact frame (PHOTO_W x PHOTO_H), as shown in the preview."""
+        return self.render(src, params, frame_only=True)
+
+
+class SheetLayout:
+    """Imposition of several frames on one print sheet (gang-up printing).
+
+    Frames keep their exact pixel size at the engine's DPI and sit in a
+    centered grid with ``sheet_gutter_mm`` between them and at least
+    ``sheet_margin_mm`` to the sheet edge. Cut marks go into the margin,
+    one pair per cut line, so a guillotine can cut the whole grid.
+    """
+
+    MARK_GAP_MM = 1.0
+    MARK_LEN_MM = 5.0
+    MARK_WIDTH_MM = 0.1
+
+    def __init__(self, engine):
+        config = engine.config
+        self.engine = engine
+        self.width = engine.mm_to_px(config.get("sheet_w_mm", 210.0), ceil_value=True)
+        self.height = engine.mm_to_px(config.get("sheet_h_mm", 297.0), ceil_value=True)
+        self.cut_marks = bool(config.get("sheet_cut_marks", True))
+        gutter = self._px(config.get("sheet_gutter_mm", 4.0))
+        margin = self._px(config.get("sheet_margin_mm", 8.0))
+        frame_w, frame_h = engine.PHOTO_W, engine.PHOTO_H
+        self.frame_size = (frame_w, frame_h)
+        self.cols = max(0, (self.width - 2 * margin + gutter) // (frame_w + gutter))
+        self.rows = max(0, (self.height - 2 * margin + gutter) // (frame_h + gutter))
+        if not self.cols or not self.rows:
+            raise ValueError("Der Rahmen passt nicht auf den Druckbogen (Bogengröße/Rand prüfen).")
+        x0 = (self.width - (self.cols * (frame_w + gutter) - gutter)) // 2
+        y0 = (self.height - (self.rows * (frame_h + gutter) - gutter)) // 2
+        self.slots = [(x0 + c * (frame_w + gutter), y0 + r * (frame_h + gutter))
+                      for r in range(self.rows) for c in range(self.cols)]
+
+    def _px(self, mm_value):
+        mm_value = float(mm_value)
+        return self.engine.mm_to_px(mm_value) if mm_value > 0 else 0
+
+    @property
+    def capacity(self):
+        return len(self.slots)
+
+    def new_sheet(self):
+        return Image.new("RGB", (self.width, self.height), "#FFFFFF")
+
+    def draw_cut_marks(self, sheet, used_slots):
+        """Draw marks for every cut line of the used slots into the margin."""
+        if not self.cut_marks or not used_slots:
+            return
+        frame_w, frame_h = self.frame_size
+        xs = sorted({x for x, _ in used_slots} | {x + frame_w for x, _ in used_slots})
+        ys = sorted({y for _, y in used_slots} | {y + frame_h for _, y in used_slots})
+        left, right, top, bottom = xs[0], xs[-1], ys[0], ys[-1]
+        gap = self._px(self.MARK_GAP_MM)
+        length = self._px(self.MARK_LEN_MM)
+        width = self._px(self.MARK_WIDTH_MM) or 1
+        from PIL import ImageDraw
+        draw = ImageDraw.Draw(sheet)
+        # Marks are clipped to the margin so they never reach the sheet edge or a frame.
+        for x in xs:
+            for a, b in ((max(0, top - gap - length), top - gap), (bottom + gap, min(self.height - 1, bottom + gap + length))):
+                if b > a:
+                    draw.line([(x, a), (x, b)], fill="#000000", width=width)
+        for y in ys:
+            for a, b in ((max(0, left - gap - length), left - gap), (right + gap, min(self.width - 1, right + gap + length))):
+                if b > a:
+                    draw.line([(a, y), (b, y)], fill="#000000", width=width)
+
+
+class PreviewRenderer:
+    """Builds the preview directly at screen size from a pre-reduced source.
+
+    Parameters stay in print-pixel units (as used by the export engine) and
+    are mapped onto the reduced proxy here, so only the export ever touches
+    the full-resolution source.
+    """
+
+    # Keep the proxy at least this much larger than what the preview shows,
+    # so LANCZOS still downsamples after border/text changes grow the scale.
+    PROXY_HEADROOM = 2.0
+
+    def __init__(self, engine, preview_scale):
+        self.engine = engine
+        self.preview_scale = float(preview_scale)
+        # The preview worker hands each frame to the Tk thread while rendering the next: double buffering.
+        self.preview = RenderEngine(engine.config, pixel_scale=self.preview_scale, cache_levels=True,
+                                    compositor=engine.compositor, reuse_buffers=True)
+        self.size = (self.preview.PHOTO_W, self.preview.PHOTO_H)
+        self._src = None
+        self._proxy = None
+        self._proxy_factor = 1
+        self._pending_config = None
+        self._lock = threading.Lock()
+
+    def reconfigure(self, config, changed):
+        """Queue a settings change (not geometry) for the next render.
+
+        Renders run on the preview worker thread, so the engine's caches are
+        only touched there; changes queued in between are merged.
+        """
+        with self._lock:
+            if self._pending_config is not None:
+                changed = changed | self._pending_config[1]
+            self._pending_config = (config, changed)
+
+    def set_source(self, src):
+        self._src = src
+        self._proxy = None
+        self._proxy_factor = 1
+
+    def _proxy_for(self, scale):
+        """Return the reduced source suitable for rendering at ``scale``."""
+        preview_px_per_src_px = scale * self.preview_scale
+        factor = max(1, int(1.0 / (preview_px_per_src_px * self.PROXY_HEADROOM)))
+        if self._proxy is None or factor < self._proxy_factor:
+            self._proxy = self._src.reduce(factor) if factor > 1 else self._src
+            self._proxy_factor = factor
+        return self._proxy
+
+    def map_params(self, params, proxy_size):
+        """Translate print-pixel params into preview pixels on the proxy."""
+        ratio = self._src.width / proxy_size[0]
+        return params.copy(
+            pan_x=params.pan_x * self.preview_scale,
+            pan_y=params.pan_y * self.preview_scale,
+            scale=params.scale * self.preview_scale * ratio,
+        )
+
+    def render(self, src, params):
+        """Render the exact frame (no oversize canvas) at preview size."""
+        with self._lock:
+            pending, self._pending_config = self._pending_config, None
+        if pending is not None:
+            self.preview.reconfigure(*pending)
+        if src is not self._src:
+            self.set_source(src)
+        proxy = self._proxy_for(params.scale)
+        return self.preview.render_frame(proxy, self.map_params(params, proxy.size))
@@ -0,0 +1,186 @@
+"""Sidecar manifests: everything needed to re-render an export without the GUI.
+
+Every export writes ``<name>.render.json`` next to the image. It records the
+render parameters in full-resolution source terms, the render and export
+config keys, and SHA-256 hashes of the source file, the config and (if one is
+used) the background image. ``render_from_manifest`` reproduces the export
+from that file alone; ``inputs_sha256`` tells whether an export is still
+current for a given config.
+"""
+import copy
+import hashlib
+import json
+import os
+import time
+
+from config_handler import EXPORT_KEYS, RENDER_KEYS, ConfigHandler, write_json_atomic
+from render_engine import RenderEngine, RenderParams, SourceImage
+
+MANIFEST_VERSION = 1
+SIDECAR_SUFFIX = ".render.json"
+MANIFEST_KEYS = RENDER_KEYS | EXPORT_KEYS
+
+
+class ManifestError(ValueError):
+    pass
+
+
+def sidecar_path(output_path):
+    return os.path.splitext(output_path)[0] + SIDECAR_SUFFIX
+
+
+def is_sidecar(path):
+    return path.lower().endswith(SIDECAR_SUFFIX)
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _json_sha256(data):
+    text = json.dumps(data, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def manifest_config(config):
+    """The part of ``config`` that decides the output file."""
+    return {key: copy.deepcopy(config[key]) for key in sorted(MANIFEST_KEYS) if key in config}
+
+
+def config_sha256(config):
+    return _json_sha256(manifest_config(config))
+
+
+def background_sha256(engine):
+    """Hash of the background image file, or ``None`` if the stripes are used."""
+    path = engine.config.get("background_image")
+    if engine.background_source() != "file" or not path or not os.path.exists(path):
+        return None
+    return file_sha256(path)
+
+
+def _params_dict(params):
+    # Through the constructor, so a pan of 0 and 0.0 hash alike.
+    return params.copy().to_dict()
+
+
+def inputs_sha256(source_sha, params, config_sha, background_sha=None):
+    """One hash over everything an export depends on."""
+    return _json_sha256({
+        "source": source_sha,
+        "params": _params_dict(params),
+        "config": config_sha,
+        "background": background_sha,
+    })
+
+
+def build_manifest(engine, source, params, output_path, source_sha=None, background_sha=None):
+    """Describe the export of ``source`` with ``params`` (full-resolution terms)."""
+    source_sha = source_sha or file_sha256(source.path)
+    config_sha = config_sha256(engine.config)
+    if background_sha is None:
+        background_sha = background_sha256(engine)
+    return {
+        "version": MANIFEST_VERSION,
+        "output": os.path.basename(output_path),
+        "source": os.path.abspath(source.path),
+        "source_size": list(source.size),
+        "source_sha256": source_sha,
+        "params": _params_dict(params),
+        "config": manifest_config(engine.config),
+        "config_sha256": config_sha,
+        "background_sha256": background_sha,
+        "inputs_sha256": inputs_sha256(source_sha, params, config_sha, background_sha),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def write_manifest(engine, source, params, output_path, **hashes):
+    manifest = build_manifest(engine, source, params, output_path, **hashes)
+    write_json_atomic(sidecar_path(output_path), manifest)
+    return manifest
+
+
+def read_manifest(path):
+    """Load a sidecar; ``path`` may also be the exported image itself."""
+    if not is_sidecar(path):
+        path = sidecar_path(path)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as ex:
+        raise ManifestError(f"{path}: {ex}") from ex
+    if not isinstance(manifest, dict) or manifest.get("version") != MANIFEST_VERSION:
+        raise ManifestError(f"{path}: unbekannte Manifest-Version")
+    for key in ("output", "source", "source_sha256", "params", "config"):
+        if key not in manifest:
+            raise ManifestError(f"{path}: Feld '{key}' fehlt")
+    manifest["path"] = os.path.abspath(path)
+    return manifest
+
+
+def manifest_params(manifest):
+    return RenderParams.from_dict(manifest["params"])
+
+
+def manifest_source(manifest):
+    """Path of the source; falls back to the file name next to the manifest."""
+    path = manifest["source"]
+    if not os.path.exists(path) and manifest.get("path"):
+        nearby = os.path.join(os.path.dirname(manifest["path"]), os.path.basename(path))
+        if os.path.exists(nearby):
+            return nearby
+    return path
+
+
+def manifest_output(manifest, out_dir=None):
+    return os.path.join(out_dir or os.path.dirname(manifest["path"]), manifest["output"])
+
+
+def stale_reason(manifest, config_sha, background_sha):
+    """Why the manifest's export is out of date for the given hashes, or ``None``."""
+    if not os.path.exists(manifest_output(manifest)):
+        return "Ausgabe fehlt"
+    expected = inputs_sha256(manifest["source_sha256"], manifest_params(manifest), config_sha, background_sha)
+    if manifest.get("inputs_sha256") == expected:
+        return None
+    if manifest.get("config_sha256") != config_sha:
+        return "Konfiguration geändert"
+    if manifest.get("background_sha256") != background_sha:
+        return "Hintergrundbild geändert"
+    return "Manifest geändert"
+
+
+def engine_config(manifest):
+    """Config the export was made with: defaults plus the recorded keys."""
+    config = ConfigHandler.get_default()
+    config.update(copy.deepcopy(manifest["config"]))
+    return config
+
+
+def render_from_manifest(manifest, output_path, engine=None, source_sha=None):
+    """Re-render a manifest's export to ``output_path`` and write its sidecar.
+
+    Without ``engine`` the recorded config is used, which reproduces the
+    original file. Passing an engine for another config renders the same
+    framing with the new settings: scale and pan are fitted again, because
+    the photo area may have changed, and the new sidecar records the fitted
+    values. Raises ``ManifestError`` if the source file no longer matches the
+    recorded hash.
+    """
+    path = manifest_source(manifest)
+    source_sha = source_sha or file_sha256(path)
+    if source_sha != manifest["source_sha256"]:
+        raise ManifestError(f"{path}: Quelldatei wurde verändert (Hash stimmt nicht)")
+    engine = engine or RenderEngine(engine_config(manifest))
+    source = SourceImage(path)
+    params = manifest_params(manifest)
+    if config_sha256(engine.config) != manifest.get("config_sha256"):
+        params = engine.fit(source.size, params)
+    img, img_params = source.load_for(engine, params)
+    engine.save(engine.render(img, img_params), output_path)
+    return write_manifest(engine, source, params, output_path, source_sha=source_sha)
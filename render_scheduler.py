@@ -0,0 +1,252 @@
+import math
+import threading
+import time
+from collections import deque
+
+
+class RenderScheduler:
+    """Coalesces preview requests into at most one render per display frame.
+
+    Every parameter change (pan, border, text, position, triangle) only calls
+    ``request``; the render callback runs once per frame and always reads the
+    latest state. ``fit=True`` asks for an image re-fit before that render.
+    """
+
+    DEFAULT_FPS = 60.0
+
+    def __init__(self, widget, render, fps=DEFAULT_FPS):
+        self.widget = widget
+        self.render = render
+        self.frame_s = 1.0 / self.DEFAULT_FPS
+        self.set_fps(fps)
+        self._after_id = None
+        self._pending_fit = False
+        self._last_start = 0.0
+
+    def set_fps(self, fps):
+        try:
+            fps = float(fps)
+        except (TypeError, ValueError):
+            fps = self.DEFAULT_FPS
+        self.frame_s = 1.0 / max(1.0, fps)
+
+    def request(self, fit=False):
+        self._pending_fit = self._pending_fit or fit
+        if self._after_id is not None:
+            return
+        # A render that overran its frame is followed by after(0): Tk still
+        # drains queued input first, so the next render sees the newest state.
+        delay = self._last_start + self.frame_s - time.perf_counter()
+        self._after_id = self.widget.after(max(0, int(math.ceil(delay * 1000))), self._run)
+
+    def flush(self):
+        """Render a pending request right now (e.g. before an export)."""
+        if self._after_id is None:
+            return
+        self.widget.after_cancel(self._after_id)
+        self._run()
+
+    def cancel(self):
+        if self._after_id is not None:
+            self.widget.after_cancel(self._after_id)
+        self._after_id = None
+        self._pending_fit = False
+
+    def _run(self):
+        self._after_id = None
+        fit, self._pending_fit = self._pending_fit, False
+        self._last_start = time.perf_counter()
+        self.render(fit)
+
+
+class PreviewWorker:
+    """Runs preview renders on a background thread.
+
+    Every ``submit`` gets a new generation token and replaces any job that
+    has not started yet. Results of older generations are dropped, so only
+    the newest state is ever shown. ``on_done(result, error)`` is called on
+    the Tk thread (via ``after`` polling), which is where the
+    ``ImageTk.PhotoImage`` hand-off has to happen.
+    """
+
+    POLL_MS = 5
+
+    def __init__(self, widget):
+        self.widget = widget
+        self._cond = threading.Condition()
+        self._generation = 0
+        self._job = None
+        self._busy = False
+        self._result = None
+        self._closed = False
+        self._poll_id = None
+        self._thread = threading.Thread(target=self._loop, name="preview-render", daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, on_done):
+        with self._cond:
+            self._generation += 1
+            self._job = (self._generation, fn, on_done)
+            self._cond.notify()
+        self._ensure_polling()
+
+    def cancel(self):
+        """Drop the queued job and any result still in flight."""
+        with self._cond:
+            self._generation += 1
+            self._job = None
+            self._result = None
+
+    def close(self):
+        self.cancel()
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        if self._poll_id is not None:
+            self.widget.after_cancel(self._poll_id)
+            self._poll_id = None
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while self._job is None and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                generation, fn, on_done = self._job
+                self._job = None
+                self._busy = True
+            try:
+                result, error = fn(), None
+            except Exception as ex:
+                result, error = None, ex
+            with self._cond:
+                self._busy = False
+                if generation == self._generation:
+                    self._result = (generation, result, error, on_done)
+
+    def _ensure_polling(self):
+        if self._poll_id is None and not self._closed:
+            self._poll_id = self.widget.after(self.POLL_MS, self._poll)
+
+    def _poll(self):
+        self._poll_id = None
+        with self._cond:
+            done, self._result = self._result, None
+            current = self._generation
+            idle = self._job is None and not self._busy
+        if done is not None and done[0] == current:
+            _, result, error, on_done = done
+            on_done(result, error)
+        if not idle:
+            self._ensure_polling()
+
+
+class ExportJob:
+    """One queued export; ``state`` is queued, running, done or failed."""
+
+    def __init__(self, label, fn):
+        self.label = label
+        self.fn = fn
+        self.state = "queued"
+        self.fraction = 0.0
+        self.step = ""
+        self.error = None
+
+
+class ExportQueue:
+    """Runs exports one after another on a background thread.
+
+    ``submit(label, fn)`` queues ``fn(report)``; the job calls
+    ``report(fraction, step)`` between its stages. ``on_update(job, waiting)``
+    runs on the Tk thread (via ``after`` polling) whenever a job is queued,
+    reports progress or finishes; ``waiting`` is the number of jobs not yet
+    started. Full-resolution exports are memory-heavy, so there is a single
+    worker and jobs never run side by side.
+    """
+
+    POLL_MS = 50
+
+    def __init__(self, widget, on_update):
+        self.widget = widget
+        self.on_update = on_update
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._events = deque()
+        self._running = None
+        self._closed = False
+        self._poll_id = None
+        self._thread = threading.Thread(target=self._loop, name="export", daemon=True)
+        self._thread.start()
+
+    @property
+    def pending(self):
+        """Jobs queued or running."""
+        with self._cond:
+            return len(self._queue) + (self._running is not None)
+
+    def submit(self, label, fn):
+        job = ExportJob(label, fn)
+        with self._cond:
+            self._queue.append(job)
+            self._events.append(job)
+            self._cond.notify()
+        self._ensure_polling()
+        return job
+
+    def close(self, wait=False):
+        """Stop after the running job; queued jobs are dropped.
+
+        With ``wait`` this blocks until the running job has finished, so the
+        process can exit without leaving a half-written file behind.
+        """
+        with self._cond:
+            self._queue.clear()
+            self._closed = True
+            self._cond.notify()
+        if self._poll_id is not None:
+            self.widget.after_cancel(self._poll_id)
+            self._poll_id = None
+        if wait:
+            self._thread.join()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                job = self._running = self._queue.popleft()
+                job.state = "running"
+                self._events.append(job)
+
+            def report(fraction, step=""):
+                job.fraction, job.step = fraction, step
+                with self._cond:
+                    self._events.append(job)
+
+            try:
+                job.fn(report)
+                job.fraction, job.state = 1.0, "done"
+            except Exception as ex:
+                job.error, job.state = ex, "failed"
+            with self._cond:
+                self._running = None
+                self._events.append(job)
+
+    def _ensure_polling(self):
+        if self._poll_id is None and not self._closed:
+            self._poll_id = self.widget.after(self.POLL_MS, self._poll)
+
+    def _poll(self):
+        self._poll_id = None
+        with self._cond:
+            events, self._events = self._events, deque()
+            waiting = len(self._queue)
+            idle = not waiting and self._running is None
+        # Several reports of one job since the last poll collapse into its current state.
+        for job in dict.fromkeys(events):
+            self.on_update(job, waiting)
+        if not idle:
+            self._ensure_polling()
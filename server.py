@@ -0,0 +1,259 @@
+"""Local HTTP render service (standard library only).
+
+Usage:
+    python server.py [--host 127.0.0.1] [--port 8765] [--config config.json] [--jobs N]
+
+``POST /render`` takes the photo either as the raw request body or as the
+``image`` field of a multipart form. Render parameters are the keys of a
+batch.py list entry (``text``, ``border_mm``, ``text_pos``, ``triangle``,
+``pan_x``, ``pan_y``), given as query parameters or form fields. The answer
+is the print file in the configured export format::
+
+    curl --data-binary @foto.jpg -o druck.jpg "http://127.0.0.1:8765/render?text=Muster,%20Max&triangle=ja"
+
+``GET /stats`` returns request counts, latency (p50/p95/max) and throughput
+as JSON. Renders run in a process pool that is started and warmed up (fonts,
+background, layout) before the first request; each worker keeps its engine
+and caches for its whole life.
+"""
+import argparse
+import io
+import json
+import signal
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, wait
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, quote, urlsplit
+
+from PIL import Image, UnidentifiedImageError
+
+import batch
+from batch import _init_worker, available_cpus, build_params
+from config_handler import CONFIG_FILE, ConfigHandler
+from render_engine import RenderEngine, RenderParams, SourceImage
+
+CONTENT_TYPES = {"jpeg": "image/jpeg", "png": "image/png", "tiff16": "image/tiff"}
+PARAM_KEYS = ("text", "border_mm", "text_pos", "triangle", "pan_x", "pan_y")
+DEFAULT_PORT = 8765
+MAX_UPLOAD_MB = 200
+BUSY_TIMEOUT_S = 30.0
+
+
+def _init_server_worker(config):
+    _init_worker(config)
+    engine = batch._engine
+    # Fonts, background layer and layout plan are loaded here, not on the first request.
+    blank = Image.new("RGB", (engine.PHOTO_W, engine.PHOTO_H), "white")
+    params = engine.fit(blank.size, RenderParams(engine.border_range()[2], text="Musterbruder, Max rec. 01.01.2000"))
+    engine.render(blank, params)
+
+
+def _worker_ready():
+    return True
+
+
+def _render_upload(data, entry):
+    """Runs in a worker: decode, fit, render and encode one upload."""
+    engine = batch._engine
+    source = SourceImage(io.BytesIO(data))
+    params = engine.fit(source.size, build_params(engine, entry))
+    img, img_params = source.load_for(engine, params)
+    out = engine.render(img, img_params)
+    del img
+    buf = io.BytesIO()
+    engine.save(out, buf)
+    return buf.getvalue()
+
+
+class RequestStats:
+    """Request latency and throughput over the server's lifetime and a recent window."""
+
+    WINDOW = 1000
+    RATE_WINDOW_S = 60.0
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.requests = 0
+        self.errors = 0
+        self._recent = deque(maxlen=self.WINDOW)  # (finished at, ms)
+        self._lock = threading.Lock()
+
+    def record(self, ms, ok=True):
+        with self._lock:
+            self.requests += 1
+            if not ok:
+                self.errors += 1
+            self._recent.append((time.monotonic(), ms))
+
+    def summary(self):
+        with self._lock:
+            recent = list(self._recent)
+            requests, errors = self.requests, self.errors
+        now = time.monotonic()
+        uptime = now - self.started
+        latencies = sorted(ms for _, ms in recent)
+
+        def pct(p):
+            return round(latencies[min(len(latencies) - 1, int(round(p * (len(latencies) - 1))))], 1) if latencies else None
+
+        last_minute = sum(1 for t, _ in recent if now - t <= self.RATE_WINDOW_S)
+        return {
+            "requests": requests,
+            "errors": errors,
+            "uptime_s": round(uptime, 1),
+            "per_s": round(requests / uptime, 3) if uptime > 0 else 0.0,
+            "per_s_last_minute": round(last_minute / min(self.RATE_WINDOW_S, max(uptime, 1e-9)), 3),
+            "ms_p50": pct(0.5),
+            "ms_p95": pct(0.95),
+            "ms_max": round(latencies[-1], 1) if latencies else None,
+        }
+
+
+class RenderHandler(BaseHTTPRequestHandler):
+    server_version = "AhnentafelRender/1.0"
+
+    def do_GET(self):
+        if urlsplit(self.path).path == "/stats":
+            self._send(200, json.dumps(self.server.stats.summary()).encode("utf-8"), "application/json")
+        else:
+            self._send(404, b"Nicht gefunden", "text/plain; charset=utf-8")
+
+    def do_POST(self):
+        start = time.perf_counter()
+        url = urlsplit(self.path)
+        if url.path != "/render":
+            self._send(404, b"Nicht gefunden", "text/plain; charset=utf-8")
+            return
+        status, ok = 200, False
+        try:
+            data, entry = self._read_upload(dict(parse_qsl(url.query)))
+            status, body, ctype, filename = self._render(data, entry)
+            ok = status == 200
+        except ValueError as ex:
+            status, body, ctype, filename = 400, str(ex).encode("utf-8"), "text/plain; charset=utf-8", None
+        ms = (time.perf_counter() - start) * 1000.0
+        self.server.stats.record(ms, ok)
+        self.render_ms = ms
+        headers = {"X-Render-Ms": f"{ms:.1f}"}
+        if filename:
+            headers["Content-Disposition"] = f"attachment; filename*=UTF-8''{quote(filename, safe='')}"
+        self._send(status, body, ctype, headers)
+
+    def _read_upload(self, entry):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0:
+            raise ValueError("Kein Bild im Request")
+        if length > self.server.max_bytes:
+            raise ValueError(f"Bild größer als {self.server.max_bytes // (1024 * 1024)} MB")
+        body = self.rfile.read(length)
+        ctype = self.headers.get("Content-Type", "")
+        if not ctype.startswith("multipart/form-data"):
+            return body, entry
+        message = BytesParser(policy=HTTP).parsebytes(b"Content-Type: " + ctype.encode("latin-1") + b"\r\n\r\n" + body)
+        data = None
+        for part in message.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            payload = part.get_payload(decode=True) or b""
+            if name == "image":
+                data = payload
+            elif name in PARAM_KEYS:
+                entry[name] = payload.decode(part.get_content_charset() or "utf-8")
+        if not data:
+            raise ValueError("Formularfeld 'image' fehlt")
+        return data, entry
+
+    def _render(self, data, entry):
+        entry = {k: v for k, v in entry.items() if k in PARAM_KEYS}
+        server = self.server
+        if not server.slots.acquire(timeout=BUSY_TIMEOUT_S):
+            return 503, b"Server ausgelastet", "text/plain; charset=utf-8", None
+        try:
+            result = server.pool.submit(_render_upload, data, entry).result()
+        except (ValueError, UnidentifiedImageError) as ex:
+            # Not an image, or unusable parameters: the client's fault.
+            return 400, f"{type(ex).__name__}: {ex}".encode("utf-8"), "text/plain; charset=utf-8", None
+        except Exception as ex:
+            return 500, f"{type(ex).__name__}: {ex}".encode("utf-8"), "text/plain; charset=utf-8", None
+        finally:
+            server.slots.release()
+        filename = server.engine.suggest_filename(entry.get("text") or "") + server.engine.export_extension()
+        return 200, result, CONTENT_TYPES[server.engine.export_format()], filename
+
+    def _send(self, status, body, ctype, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", ctype)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        if not self.server.quiet:
+            sys.stderr.write(f"{self.address_string()} {fmt % args}\n")
+
+    def log_request(self, code="-", size="-"):
+        ms = getattr(self, "render_ms", None)
+        self.log_message('"%s" %s %s', self.requestline, str(code), f"{ms:.1f} ms" if ms is not None else "")
+
+
+class RenderServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config, jobs=None, max_mb=MAX_UPLOAD_MB, quiet=False):
+        super().__init__(address, RenderHandler)
+        self.engine = RenderEngine(config)
+        self.jobs = max(1, jobs or available_cpus())
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.quiet = quiet
+        self.stats = RequestStats()
+        # Two renders per worker may wait in the pool; more requests block, then get a 503.
+        self.slots = threading.BoundedSemaphore(2 * self.jobs)
+        self.pool = ProcessPoolExecutor(max_workers=self.jobs, initializer=_init_server_worker, initargs=(config,))
+        wait([self.pool.submit(_worker_ready) for _ in range(self.jobs)])
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown()
+
+
+def _stop(signum, frame):
+    raise KeyboardInterrupt
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ahnentafel Optimaldruck als lokaler Render-Dienst")
+    parser.add_argument("--host", default="127.0.0.1", help="Adresse (Standard: 127.0.0.1, nur dieser Rechner)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port (Standard: {DEFAULT_PORT})")
+    parser.add_argument("--config", default=CONFIG_FILE, help="Pfad zur config.json")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Anzahl Render-Prozesse (Standard: alle Kerne)")
+    parser.add_argument("--max-mb", type=float, default=MAX_UPLOAD_MB, help=f"Größte Bilddatei in MB (Standard: {MAX_UPLOAD_MB})")
+    parser.add_argument("-q", "--quiet", action="store_true", help="Keine Zeile je Request ausgeben")
+    args = parser.parse_args(argv)
+
+    config = ConfigHandler.load(args.config)
+    if not config:
+        print(f"Konfiguration {args.config} fehlt oder ist ungültig. Bitte zuerst main.py starten.", file=sys.stderr)
+        return 2
+    start = time.perf_counter()
+    server = RenderServer((args.host, args.port), config, jobs=args.jobs, max_mb=args.max_mb, quiet=args.quiet)
+    print(f"Bereit in {time.perf_counter() - start:.2f} s: http://{args.host}:{server.server_address[1]}/render ({server.jobs} Prozesse)")
+    # Stop like Ctrl+C on a service manager's SIGTERM, so the summary still gets printed.
+    signal.signal(signal.SIGTERM, _stop)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(server.stats.summary()))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,45 +1,43 @@
+import copy
 import os
 import re
 import tkinter as tk
 from tkinter import colorchooser, filedialog, messagebox, ttk
 
-from config_handler import ConfigHandler, MAX_MM_LIMIT
+from config_handler import COMPOSITORS, ConfigHandler, ConfigStore, EXPORT_FORMATS, FRAME_PRESETS, JPEG_SUBSAMPLING, MAX_MM_LIMIT
 
-try:
-    from tkinterdnd2 import DND_FILES
-    DND_AVAILABLE = True
-except Exception:
-    DND_FILES = None
-    DND_AVAILABLE = False
+
+def enable_dnd(root):
+    """Load tkdnd into ``root``'s Tcl interpreter once; False without tkinterdnd2.
+
+    tkinterdnd2 is slow to import (noticeably in the onefile build), so main.py
+    calls this after the first paint instead of creating a TkinterDnD.Tk.
+    """
+    enabled = getattr(root, "_dnd_enabled", None)
+    if enabled is None:
+        try:
+            from tkinterdnd2 import TkinterDnD
+            TkinterDnD._require(root)
+            enabled = True
+        except Exception:
+            enabled = False
+        root._dnd_enabled = enabled
+    return enabled
 
 class SettingsWindow(tk.Toplevel):
-    FRAME_PRESETS = {
-        "Neuer Holzrahmen": {
-            "photo_h_mm": 100.0,
-            "photo_w_mm": 69.5,
-            "canvas_h_mm": 130.0,
-            "canvas_w_mm": 90.0,
-            "border_default_mm": 3.0,
-            "fixed_bottom_mm": 7.0,
-            "fixed_distance_mm": 5.0,
-        },
-        "Alter Holzrahmen": {
-            "photo_h_mm": 100.0,
-            "photo_w_mm": 71.0,
-            "canvas_h_mm": 130.0,
-            "canvas_w_mm": 90.0,
-            "border_default_mm": 1.7,
-            "fixed_bottom_mm": 5.0,
-            "fixed_distance_mm": 4.0,
-        },
-    }
-
-    def __init__(self, parent, callback, is_initial=False):
+    FRAME_PRESETS = FRAME_PRESETS
+
+    def __init__(self, parent, callback=None, is_initial=False, store=None):
         super().__init__(parent)
         self.title("Initial-Konfiguration v1.1.1")
         self.callback = callback
         self.is_initial = is_initial
-        self.config = ConfigHandler.load() or ConfigHandler.get_default()
+        if store is None:
+            store = ConfigStore()
+            store.load()
+        self.store = store
+        # Edit a private copy; the store only changes (and notifies) on save.
+        self.config = copy.deepcopy(store.config)
         if "background_source" not in self.config:
             self.config["background_source"] = "file" if self.config.get("use_background_image", False) else "colors"
         
@@ -135,8 +133,9 @@ class SettingsWindow(tk.Toplevel):
         self.bg_btn.grid(row=5, column=3, sticky="w")
         self._on_bg_toggle()
 
-        if DND_AVAILABLE:
+        if enable_dnd(self._root()):
             try:
+                from tkinterdnd2 import DND_FILES
                 self.drop_target_register(DND_FILES)
                 self.dnd_bind('<<Drop>>', self._on_bg_drop)
             except Exception:
@@ -264,6 +263,9 @@ class SettingsWindow(tk.Toplevel):
             "tri": (6, "Dreieck-Kathete (% der Bildbreite):", "triangle_percent", 50.0, ".1f"),
             "border_min": (7, "Rahmen min (mm):", "border_min_mm", 0.0, ".1f"),
             "border_max": (8, "Rahmen max (mm, max 7):", "border_max_mm", 7.0, ".1f"),
+            "fps": (9, "Vorschau-Bildrate (fps):", "preview_fps", 60.0, ".0f"),
+            "jpeg_q": (12, "JPEG-Qualität (1-100):", "jpeg_quality", 98, ".0f"),
+            "png_level": (13, "PNG-Kompression (0-9):", "png_compress_level", 6, ".0f"),
         }
         
         for attr_name, (row, label, key, default, fmt) in entries_map.items():
@@ -281,6 +283,9 @@ class SettingsWindow(tk.Toplevel):
             ("triangle_percent", self.ent_tri, 1),
             ("border_min_mm", self.ent_border_min, 1),
             ("border_max_mm", self.ent_border_max, 1),
+            ("preview_fps", self.ent_fps, 0),
+            ("jpeg_quality", self.ent_jpeg_q, 0),
+            ("png_compress_level", self.ent_png_level, 0),
         ]
         
         # Text background color button
@@ -302,8 +307,28 @@ class SettingsWindow(tk.Toplevel):
         self.text_font_entry.grid(row=5, column=1, columnspan=2, sticky="w")
         tk.Button(self.adv_frame, text="Auswählen...", command=self._pick_text_font).grid(row=5, column=3, sticky="w")
         
+        self.perf_stats_var = tk.BooleanVar(value=self.config.get("perf_stats", False))
+        tk.Checkbutton(self.adv_frame, text="Zeitmessung in der Statuszeile anzeigen", variable=self.perf_stats_var).grid(row=10, column=0, columnspan=4, sticky="w")
+
+        # Export encoder
+        tk.Label(self.adv_frame, text="Exportformat:").grid(row=11, column=0, sticky="w")
+        self.export_format_var = tk.StringVar(value=self.config.get("export_format", "jpeg"))
+        ttk.Combobox(self.adv_frame, textvariable=self.export_format_var, values=list(EXPORT_FORMATS), state="readonly", width=8).grid(row=11, column=1, sticky="w")
+        tk.Label(self.adv_frame, text="Chroma-Subsampling:").grid(row=11, column=2, sticky="w", padx=(10, 0))
+        self.jpeg_subsampling_var = tk.StringVar(value=self.config.get("jpeg_subsampling", "auto"))
+        ttk.Combobox(self.adv_frame, textvariable=self.jpeg_subsampling_var, values=list(JPEG_SUBSAMPLING), state="readonly", width=6).grid(row=11, column=3, sticky="w")
+        self.jpeg_optimize_var = tk.BooleanVar(value=self.config.get("jpeg_optimize", False))
+        tk.Checkbutton(self.adv_frame, text="JPEG optimieren", variable=self.jpeg_optimize_var).grid(row=14, column=0, sticky="w")
+        self.jpeg_progressive_var = tk.BooleanVar(value=self.config.get("jpeg_progressive", False))
+        tk.Checkbutton(self.adv_frame, text="JPEG progressiv", variable=self.jpeg_progressive_var).grid(row=14, column=1, columnspan=2, sticky="w")
+
+        # Render backend (numpy only if installed; falls back to pillow otherwise)
+        tk.Label(self.adv_frame, text="Compositor:").grid(row=15, column=0, sticky="w")
+        self.compositor_var = tk.StringVar(value=self.config.get("compositor", "pillow"))
+        ttk.Combobox(self.adv_frame, textvariable=self.compositor_var, values=list(COMPOSITORS), state="readonly", width=8).grid(row=15, column=1, sticky="w")
+
         # Reset button
-        tk.Button(self.adv_frame, text="Erweiterte Einstellung wiederherstellen", command=self._restore_advanced).grid(row=9, column=0, columnspan=4, pady=6)
+        tk.Button(self.adv_frame, text="Erweiterte Einstellung wiederherstellen", command=self._restore_advanced).grid(row=16, column=0, columnspan=4, pady=6)
 
     def pick_color(self, idx):
         color = colorchooser.askcolor(initialcolor=self.config["colors"][idx])[1]
@@ -374,6 +399,12 @@ class SettingsWindow(tk.Toplevel):
         self.text_bg.set(d.get('text_bg_color', "#FFFFFF"))
         self.text_color.set(d.get('text_color', "#000000"))
         self.text_font.set(d.get('text_font', "arial.ttf"))
+        self.export_format_var.set(d.get('export_format', "jpeg"))
+        self.jpeg_subsampling_var.set(d.get('jpeg_subsampling', "auto"))
+        self.jpeg_optimize_var.set(d.get('jpeg_optimize', False))
+        self.jpeg_progressive_var.set(d.get('jpeg_progressive', False))
+        self.compositor_var.set(d.get('compositor', "pillow"))
+        self.perf_stats_var.set(d.get('perf_stats', False))
 
     def save_and_close(self):
         try:
@@ -452,14 +483,31 @@ class SettingsWindow(tk.Toplevel):
             if adv_values["border_min_mm"] > adv_values["border_max_mm"]:
                 messagebox.showerror("Fehler", "Rahmen min darf nicht größer als Rahmen max sein.")
                 return
+            if not (1.0 <= adv_values["preview_fps"] <= 240.0):
+                messagebox.showerror("Fehler", "Vorschau-Bildrate muss zwischen 1 und 240 fps liegen.")
+                return
+            if not (1 <= adv_values["jpeg_quality"] <= 100):
+                messagebox.showerror("Fehler", "JPEG-Qualität muss zwischen 1 und 100 liegen.")
+                return
+            if not (0 <= adv_values["png_compress_level"] <= 9):
+                messagebox.showerror("Fehler", "PNG-Kompression muss zwischen 0 und 9 liegen.")
+                return
+            adv_values["jpeg_quality"] = int(adv_values["jpeg_quality"])
+            adv_values["png_compress_level"] = int(adv_values["png_compress_level"])
 
             self.config.update(adv_values)
             self.config["text_bg_color"] = self.text_bg.get()
             self.config["text_color"] = self.text_color.get()
             self.config["text_font"] = self.text_font.get().strip()
-
-            ConfigHandler.save(self.config)
-            self.callback()
+            self.config["perf_stats"] = bool(self.perf_stats_var.get())
+            self.config["export_format"] = self.export_format_var.get()
+            self.config["jpeg_subsampling"] = self.jpeg_subsampling_var.get()
+            self.config["jpeg_optimize"] = bool(self.jpeg_optimize_var.get())
+            self.config["jpeg_progressive"] = bool(self.jpeg_progressive_var.get())
+            self.config["compositor"] = self.compositor_var.get()
+
+            self.store.replace(self.config)
+            if self.callback: self.callback()
             self.destroy()
         except ValueError:
             messagebox.showerror("Fehler", "Bitte nur Zahlen eingeben.")
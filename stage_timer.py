@@ -0,0 +1,121 @@
+"""Lightweight per-stage timing for the render hot paths.
+
+Usage::
+
+    with TIMER.stage("resize"):
+        ...
+
+While disabled, ``stage`` hands out one shared no-op context manager, so
+instrumented code pays only a method call. When enabled, every stage keeps
+its recent samples (last/avg/p95 for the status bar) and can additionally
+append one JSON line per sample to a log file.
+"""
+import json
+import threading
+import time
+from collections import deque
+
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage:
+    __slots__ = ("timer", "name", "start")
+
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timer.record(self.name, (time.perf_counter() - self.start) * 1000.0)
+        return False
+
+
+class StageTimer:
+    WINDOW = 200
+
+    def __init__(self):
+        self.enabled = False
+        self._samples = {}
+        self._order = []
+        self._lock = threading.Lock()
+        self._log = None
+
+    def configure(self, enabled=False, log_path=None):
+        """Enable sampling; ``log_path`` additionally appends JSON lines there.
+
+        If the log cannot be opened, sampling still runs without it and the
+        ``OSError`` is returned (``None`` otherwise).
+        """
+        error = None
+        with self._lock:
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+            if log_path:
+                try:
+                    self._log = open(log_path, "a", encoding="utf-8", buffering=1)
+                except OSError as ex:
+                    error = ex
+            self.enabled = bool(enabled or log_path)
+        return error
+
+    def stage(self, name):
+        if not self.enabled:
+            return _NULL_STAGE
+        return _Stage(self, name)
+
+    def record(self, name, ms):
+        with self._lock:
+            samples = self._samples.get(name)
+            if samples is None:
+                samples = self._samples[name] = deque(maxlen=self.WINDOW)
+                self._order.append(name)
+            samples.append(ms)
+            if self._log is not None:
+                self._log.write(json.dumps({
+                    "ts": round(time.time(), 3),
+                    "stage": name,
+                    "ms": round(ms, 3),
+                    "thread": threading.current_thread().name,
+                }) + "\n")
+
+    def reset(self):
+        with self._lock:
+            self._samples.clear()
+            self._order.clear()
+
+    def summary(self):
+        """Return ``{stage: (last_ms, avg_ms, p95_ms)}`` in first-seen order."""
+        with self._lock:
+            snapshot = [(name, list(self._samples[name])) for name in self._order]
+        result = {}
+        for name, samples in snapshot:
+            ordered = sorted(samples)
+            p95 = ordered[min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))]
+            result[name] = (samples[-1], sum(samples) / len(samples), p95)
+        return result
+
+    def format_status(self, stages=None):
+        parts = []
+        for name, (last, avg, p95) in self.summary().items():
+            if stages is None or name in stages:
+                parts.append(f"{name} {last:.1f}/{avg:.1f}/{p95:.1f}")
+        return ("ms letzt/Ø/p95: " + " | ".join(parts)) if parts else ""
+
+
+TIMER = StageTimer()
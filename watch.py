@@ -0,0 +1,306 @@
+"""Headless watch mode: render every image that appears in a folder.
+
+Usage:
+    python watch.py eingang/ -o ausgabe/ [--config config.json] [--jobs N] [--interval S] [--settle S] [--once]
+
+The input folder is polled, so it works on network shares too. A file is
+only picked up once its size and modification time have stayed the same for
+``--settle`` seconds (still being copied otherwise). The caption comes from
+``<name>.txt`` (first line) or ``<name>.json`` (the keys of a batch.py list
+entry) next to the image, else from the file name itself.
+
+At most ``--queue`` renders are in flight; everything else simply waits in
+the folder for the next poll. A file is recorded as done in
+``ausgabe/.watch_state.json`` only after its print and render sidecar have
+been written, so after a crash or restart unfinished files are rendered
+again (at least once). A file that changes later is rendered again, too.
+``config.json`` is re-read when it changes.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from batch import _init_worker, _run_job, available_cpus
+from config_handler import CONFIG_FILE, ConfigHandler, write_json_atomic
+from render_engine import RenderEngine
+from render_manifest import ManifestError, read_manifest
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".tif", ".tiff", ".bmp", ".webp")
+STATE_FILE = ".watch_state.json"
+STATE_VERSION = 1
+MAX_ATTEMPTS = 3
+
+
+def caption_from_name(name):
+    """``Musterbruder_Max rec. 10.02.2026.jpg`` -> ``Musterbruder Max rec. 10.02.2026``."""
+    return " ".join(os.path.splitext(name)[0].replace("_", " ").split())
+
+
+class WatchFolder:
+    def __init__(self, config_path, in_dir, out_dir, jobs=None, queue_size=None, settle=2.0, log=print):
+        self.config_path = config_path
+        self.in_dir = in_dir
+        self.out_dir = out_dir
+        self.jobs = max(1, jobs or available_cpus())
+        self.queue_size = max(1, queue_size or 2 * self.jobs)
+        self.settle = settle
+        self.log = log
+        self.state_path = os.path.join(out_dir, STATE_FILE)
+        self.done = self._load_state()
+        self.pool = None
+        self.config = None
+        self.config_mtime = None
+        self.engine = None
+        self._seen = {}        # name -> (signature, first time it was seen with it)
+        self._attempts = {}    # name -> (signature, failed attempts)
+        self._running = {}     # future -> (name, signature, output path, start)
+
+    # --- state -----------------------------------------------------------
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(state, dict) or state.get("version") != STATE_VERSION:
+            return {}
+        return state.get("done", {})
+
+    def _save_state(self):
+        write_json_atomic(self.state_path, {"version": STATE_VERSION, "done": self.done})
+
+    def _mark_done(self, name, signature, output_path=None, error=None):
+        if error:
+            self.done[name] = {"signature": list(signature), "error": error}
+        else:
+            self.done[name] = {"signature": list(signature), "output": os.path.basename(output_path)}
+        self._save_state()
+
+    # --- config and pool ---------------------------------------------------
+
+    def reload_config(self):
+        """(Re)start the worker pool when config.json changed; False if it is unusable."""
+        try:
+            mtime = os.stat(self.config_path).st_mtime_ns
+        except OSError:
+            mtime = None
+        if self.pool is not None and mtime == self.config_mtime:
+            return True
+        config = ConfigHandler.load(self.config_path)
+        if not config:
+            if self.pool is None:
+                self.log(f"Konfiguration {self.config_path} fehlt oder ist ungültig.")
+            return self.pool is not None
+        if self.pool is not None:
+            self.log("Konfiguration geändert, Worker werden neu gestartet")
+            self._drain()
+            self.pool.shutdown()
+        self.config, self.config_mtime = config, mtime
+        self.engine = RenderEngine(config)
+        self.pool = ProcessPoolExecutor(max_workers=self.jobs, initializer=_init_worker, initargs=(config,))
+        return True
+
+    def close(self):
+        if self.pool is not None:
+            self._drain()
+            self.pool.shutdown()
+            self.pool = None
+
+    # --- scanning ------------------------------------------------------------
+
+    def _inputs(self, name):
+        """The image plus its caption sidecar, as one signature."""
+        stem = os.path.splitext(name)[0]
+        signature = []
+        for path in (name, stem + ".txt", stem + ".json"):
+            try:
+                st = os.stat(os.path.join(self.in_dir, path))
+            except OSError:
+                continue
+            signature += [path, st.st_size, st.st_mtime_ns]
+        return tuple(signature)
+
+    def scan(self, now=None):
+        """Names of images that are complete and not yet (or no longer) done."""
+        now = time.monotonic() if now is None else now
+        ready = []
+        busy = {name for name, *_ in self._running.values()}
+        names = sorted(n for n in os.listdir(self.in_dir)
+                       if n.lower().endswith(IMAGE_EXTENSIONS) and not n.startswith((".", "~")))
+        for name in names:
+            signature = self._inputs(name)
+            if not signature or signature[0] != name or signature[1] == 0:
+                continue
+            seen = self._seen.get(name)
+            if seen is None or seen[0] != signature:
+                self._seen[name] = (signature, now)
+                continue
+            if now - seen[1] < self.settle or name in busy:
+                continue
+            done = self.done.get(name)
+            if done is not None and tuple(done["signature"]) == signature:
+                continue
+            ready.append((name, signature))
+        # Forget files that disappeared.
+        present = set(names)
+        for name in list(self._seen):
+            if name not in present:
+                del self._seen[name]
+        return ready
+
+    def entry_for(self, name):
+        """A batch.py list entry for the image: caption and optional parameters."""
+        stem = os.path.join(self.in_dir, os.path.splitext(name)[0])
+        entry = {"source": os.path.join(self.in_dir, name), "text": caption_from_name(name)}
+        if os.path.exists(stem + ".json"):
+            with open(stem + ".json", "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if not isinstance(data, dict):
+                raise ValueError(f"{stem}.json: Objekt erwartet")
+            entry.update({k: v for k, v in data.items() if k not in ("source", "output")})
+        elif os.path.exists(stem + ".txt"):
+            with open(stem + ".txt", "r", encoding="utf-8-sig") as f:
+                entry["text"] = f.readline().strip()
+        return entry
+
+    def _output_for(self, name, text):
+        """Output path from the caption; another file is never overwritten."""
+        own = (self.done.get(name) or {}).get("output", "").lower()
+        taken = {d["output"].lower() for n, d in self.done.items() if n != name and "output" in d}
+        taken |= {os.path.basename(out).lower() for n, _, out, _ in self._running.values()}
+        stem, ext = self.engine.suggest_filename(text), self.engine.export_extension()
+        candidate, n = stem + ext, 2
+        while candidate.lower() in taken or not self._may_write(candidate, own, name):
+            candidate = f"{stem} ({n}){ext}"
+            n += 1
+        return os.path.join(self.out_dir, candidate)
+
+    def _may_write(self, candidate, own, name):
+        path = os.path.join(self.out_dir, candidate)
+        if candidate.lower() == own or not os.path.exists(path):
+            return True
+        # Rendered before a crash, but not yet recorded: the sidecar names the source.
+        try:
+            return read_manifest(path)["source"] == os.path.abspath(os.path.join(self.in_dir, name))
+        except ManifestError:
+            return False
+
+    # --- processing ----------------------------------------------------------
+
+    def poll(self):
+        """One cycle: collect finished renders, then submit up to the queue size."""
+        self._collect(timeout=0)
+        if not self.reload_config():
+            return 0
+        submitted = 0
+        for name, signature in self.scan():
+            if len(self._running) >= self.queue_size:
+                break
+            try:
+                entry = self.entry_for(name)
+            except (OSError, ValueError) as ex:
+                self._failed(name, signature, f"{type(ex).__name__}: {ex}")
+                continue
+            output_path = self._output_for(name, entry.get("text") or "")
+            future = self.pool.submit(_run_job, name, entry, output_path)
+            self._running[future] = (name, signature, output_path, time.perf_counter())
+            submitted += 1
+        return submitted
+
+    def _collect(self, timeout):
+        if not self._running:
+            return
+        finished, _ = wait(list(self._running), timeout=timeout, return_when=FIRST_COMPLETED)
+        for future in finished:
+            name, signature, output_path, start = self._running.pop(future)
+            try:
+                _, _, seconds, error = future.result()
+            except Exception as ex:
+                seconds, error = time.perf_counter() - start, f"{type(ex).__name__}: {ex}"
+            if error:
+                self._failed(name, signature, error)
+            else:
+                self._attempts.pop(name, None)
+                self._mark_done(name, signature, output_path)
+                self.log(f"OK      {seconds * 1000:8.1f} ms  {name} -> {output_path}")
+
+    def _failed(self, name, signature, error):
+        previous = self._attempts.get(name)
+        attempts = previous[1] + 1 if previous and previous[0] == signature else 1
+        self._attempts[name] = (signature, attempts)
+        if attempts < MAX_ATTEMPTS:
+            self.log(f"FEHLER  {name}: {error} (Versuch {attempts}/{MAX_ATTEMPTS})")
+            return
+        # Give up until the file changes, instead of retrying it forever.
+        self._attempts.pop(name, None)
+        self._mark_done(name, signature, error=error)
+        self.log(f"FEHLER  {name}: {error} (aufgegeben)")
+
+    def _drain(self):
+        while self._running:
+            self._collect(timeout=None)
+
+    @property
+    def idle(self):
+        return not self._running
+
+    def run(self, interval=2.0, once=False):
+        """Poll until interrupted; ``once`` stops when nothing is left to do."""
+        self.log(f"Überwache {self.in_dir} -> {self.out_dir} ({self.jobs} Prozesse, Warteschlange {self.queue_size})")
+        try:
+            while True:
+                submitted = self.poll()
+                if once and not submitted and self.idle and not self._pending():
+                    break
+                self._collect(timeout=interval)
+                if self.idle:
+                    time.sleep(interval)
+        except KeyboardInterrupt:
+            self.log("Beende, laufende Bilder werden noch fertig gestellt ...")
+        finally:
+            self.close()
+
+    def _pending(self):
+        """Images that are still settling or waiting for a free slot."""
+        for name in os.listdir(self.in_dir):
+            seen = self._seen.get(name)
+            if seen is None:
+                continue
+            done = self.done.get(name)
+            if done is None or tuple(done["signature"]) != seen[0]:
+                return True
+        return False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ahnentafel Optimaldruck: Eingangsordner überwachen")
+    parser.add_argument("input", help="Eingangsordner")
+    parser.add_argument("-o", "--output", default="ausgabe", help="Zielordner (Standard: ausgabe)")
+    parser.add_argument("--config", default=CONFIG_FILE, help="Pfad zur config.json")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="Anzahl Prozesse (Standard: alle Kerne)")
+    parser.add_argument("--queue", type=int, default=None, help="Höchstens so viele Bilder gleichzeitig in Arbeit (Standard: 2 je Prozess)")
+    parser.add_argument("--interval", type=float, default=2.0, help="Abfrageintervall in Sekunden (Standard: 2)")
+    parser.add_argument("--settle", type=float, default=2.0, help="So lange muss eine Datei unverändert sein (Standard: 2 s)")
+    parser.add_argument("--once", action="store_true", help="Beenden, sobald alles abgearbeitet ist")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.input):
+        print(f"Eingangsordner {args.input} existiert nicht.", file=sys.stderr)
+        return 2
+    if os.path.abspath(args.input) == os.path.abspath(args.output):
+        print("Eingangs- und Zielordner müssen verschieden sein.", file=sys.stderr)
+        return 2
+    os.makedirs(args.output, exist_ok=True)
+    watcher = WatchFolder(args.config, args.input, args.output, jobs=args.jobs, queue_size=args.queue, settle=args.settle)
+    if not watcher.reload_config():
+        return 2
+    watcher.run(interval=args.interval, once=args.once)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())